@@ -0,0 +1,135 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Benchmarks for the database paths on synthetic data.
+# The tables are dropped and recreated: DATABASE_URL must be a scratch database.
+
+import argparse
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+import random
+import pytz
+import time
+from crashclouseau import db, models
+from crashclouseau.models import Changeset, File, Node
+
+
+def reset_database():
+    models.clear()
+    models.create()
+    models.HGAuthor.put([])
+
+
+def make_pushlog(size, end_date, nfiles=5000, seed=42):
+    """Make a synthetic pushlog (as returned by pushlog.pushlog) with size changesets"""
+    rnd = random.Random(seed)
+    files = ["dom/base/file{}.cpp".format(i) for i in range(nfiles)]
+    authors = [
+        [("dev{}@mozilla.com".format(i), "Dev {}".format(i), "dev{}".format(i))]
+        for i in range(200)
+    ]
+    start_date = end_date - relativedelta(days=20)
+    step = (end_date - start_date) / size
+    res = []
+    for i in range(size):
+        res.append(
+            {
+                "date": start_date + i * step,
+                "node": "{:012x}".format(i),
+                "backedout": False,
+                "files": rnd.sample(files, rnd.randint(1, 5)),
+                "merge": False,
+                "bug": i,
+                "author": rnd.choice(authors),
+            }
+        )
+    return res
+
+
+def bench_changeset_add(args):
+    reset_database()
+    end_date = pytz.utc.localize(datetime.utcnow())
+    data = make_pushlog(args.size, end_date)
+    nchgsets = sum(len(x["files"]) for x in data)
+
+    start = time.perf_counter()
+    models.Changeset.add(data, end_date, "nightly")
+    duration = time.perf_counter() - start
+
+    print(
+        "Changeset.add: {} changesets ({} changeset/file rows) written in {:.3f}s".format(
+            args.size, nchgsets, duration
+        )
+    )
+
+
+def find_with_join(filenames, mindate, maxdate, channel):
+    """Changeset.find before file_pushes: used as a reference"""
+    chgs = (
+        db.session.query(File.name, Node.node)
+        .select_from(Changeset)
+        .join(Node)
+        .join(File)
+    )
+    chgs = chgs.filter(
+        File.name.in_(filenames),
+        mindate <= Node.pushdate,
+        Node.pushdate <= maxdate,
+        Node.channel == channel,
+        Node.merge.is_(False),
+    )
+    res = {}
+    for fname, node in chgs:
+        res.setdefault(fname, []).append(node)
+    return res
+
+
+def bench_find(args, ncalls=200, nfilenames=20):
+    end_date = pytz.utc.localize(datetime.utcnow())
+    # a week of pushes as in inspector.get_crash_data
+    mindate = end_date - relativedelta(days=7)
+    rnd = random.Random(42)
+    print("pushes | find (ms/call) | join (ms/call)")
+    for size in [args.size // 8, args.size // 4, args.size // 2, args.size]:
+        reset_database()
+        models.Changeset.add(make_pushlog(size, end_date), end_date, "nightly")
+        db.session.execute(db.text("ANALYZE"))
+        db.session.commit()
+        calls = [
+            [
+                "dom/base/file{}.cpp".format(rnd.randrange(5000))
+                for _ in range(nfilenames)
+            ]
+            for _ in range(ncalls)
+        ]
+        timings = []
+        for find in [models.Changeset.find, find_with_join]:
+            start = time.perf_counter()
+            for filenames in calls:
+                find(filenames, mindate, end_date, "nightly")
+            timings.append(1000 * (time.perf_counter() - start) / ncalls)
+        # release the locks before dropping the tables
+        db.session.rollback()
+        print("{:6d} | {:14.3f} | {:14.3f}".format(size, *timings))
+
+
+BENCHMARKS = {"changeset_add": bench_changeset_add, "find": bench_find}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the database paths")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS.keys()))
+    parser.add_argument(
+        "--size", type=int, default=10000, help="number of synthetic changesets"
+    )
+    parser.add_argument(
+        "--clear-database",
+        action="store_true",
+        help="confirm that the database can be dropped",
+    )
+    args = parser.parse_args()
+    if not args.clear_database:
+        parser.error("the database is dropped: use --clear-database to confirm")
+
+    BENCHMARKS[args.benchmark](args)
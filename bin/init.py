@@ -3,7 +3,7 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 # from crashclouseau import models, update, create
-from crashclouseau import update
+from crashclouseau import migrations, update
 
 while True:
     try:
@@ -16,5 +16,8 @@ while True:
         pass
         # raise
 
+print("migrate")
+migrations.migrate()
+
 print("update")
 update.update_all()
@@ -0,0 +1,27 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import sys
+from crashclouseau import migrations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate the database schema")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="fail if a hot query is not backed by an index",
+    )
+    args = parser.parse_args()
+
+    migrations.migrate()
+
+    if args.check:
+        failures = migrations.check_queries()
+        for name, plan in failures:
+            print("Sequential scan in {}:\n{}\n".format(name, plan))
+        if failures:
+            sys.exit(1)
+        print("All the hot queries use an index.")
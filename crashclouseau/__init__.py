@@ -118,3 +118,27 @@ def api_reports():
     from crashclouseau import api
 
     return api.reports()
+
+
+@app.route("/api/jobs", methods=["GET"])
+@cross_origin()
+def api_jobs():
+    from crashclouseau import api
+
+    return api.jobs()
+
+
+@app.route("/api/supersearch/stats", methods=["GET"])
+@cross_origin()
+def api_supersearch_stats():
+    from crashclouseau import api
+
+    return api.supersearch_stats()
+
+
+@app.route("/api/http/stats", methods=["GET"])
+@cross_origin()
+def api_http_stats():
+    from crashclouseau import api
+
+    return api.http_stats()
@@ -4,7 +4,7 @@
 
 from flask import request, jsonify, abort
 from crashclouseau import models
-from . import buginfo, java
+from . import buginfo, httpclient, java, supersearch, worker
 
 
 def javast():
@@ -38,3 +38,15 @@ def reports():
     res = models.Signature.get_reports(signatures, product, channel)
 
     return jsonify(res)
+
+
+def jobs():
+    return jsonify(worker.get_stats())
+
+
+def supersearch_stats():
+    return jsonify(supersearch.get_stats())
+
+
+def http_stats():
+    return jsonify(httpclient.get_stats())
@@ -2,14 +2,13 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import aiohttp
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
-from functools import partial
-import json
-import requests
 import six
-import time
-from . import utils
+from urllib.parse import urlparse
+from . import config, httpclient, utils
 from .logger import logger
 
 
@@ -23,35 +22,105 @@ VERSION_PATS = {
     "beta": r'[0-9]+".0b"[0-9]+',
     "release": r"[0-9]+\.[0-9]+(\.[0-9]+)?",
 }
+# Error 429 is for 'Too many requests' and the 5xx are server errors
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def get_delay(attempt, backoff):
+    """Get the time to wait before the next attempt: the delay is doubled
+    at each attempt and is at least the one asked by Buildhub (Backoff header)"""
+    delay = config.get_buildhub_backoff_factor() * (2**attempt)
+    delay = min(delay, config.get_buildhub_max_backoff())
+    if backoff:
+        try:
+            delay = max(delay, float(backoff))
+        except ValueError:
+            pass
+    return delay
+
+
+async def fetch(session, params, callback):
+    """Query Buildhub and return the result of the callback on the json.
+    Only the queries throttled by Buildhub are retried: a connection error
+    fails immediately."""
+    retry = config.get_buildhub_retries()
+    for attempt in range(retry):
+        try:
+            async with session.post(URL, json=params) as r:
+                backoff = r.headers.get("Backoff")
+                if backoff is None and r.status not in RETRY_STATUS:
+                    r.raise_for_status()
+                    data = await r.json(content_type=None)
+                    return callback(data)
+        except Exception as e:
+            logger.error("Buildhub query failed with parameters: {}.".format(params))
+            logger.error(e, exc_info=True)
+            return None
+        await asyncio.sleep(get_delay(attempt, backoff))
 
-
-def make_request(params, sleep, retry, callback):
-    """Query Buildhub"""
-    params = json.dumps(params)
-
-    for _ in range(retry):
-        r = requests.post(URL, data=params)
-        if "Backoff" in r.headers:
-            time.sleep(sleep)
-        else:
-            try:
-                return callback(r.json())
-            except BaseException as e:
-                logger.error(
-                    "Buildhub query failed with parameters: {}.".format(params)
-                )
-                logger.error(e, exc_info=True)
-                return None
-
-    logger.error("Too many attempts in buildhub.make_request (retry={})".format(retry))
+    logger.error("Too many attempts in buildhub.fetch (retry={})".format(retry))
 
     return None
 
 
-def get(
+async def get_many_helper(queries):
+    connect, read = config.get_http_timeout()
+    timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+    semaphore = asyncio.Semaphore(config.get_buildhub_workers())
+
+    # the requests and the opened connections are added to the HTTP stats
+    stats = {"requests": 0, "connections": 0}
+
+    async def on_request_start(session, ctx, params):
+        stats["requests"] += 1
+
+    async def on_connection_create_end(session, ctx, params):
+        stats["connections"] += 1
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_connection_create_end.append(on_connection_create_end)
+
+    async def limited_fetch(session, params, callback):
+        async with semaphore:
+            return await fetch(session, params, callback)
+
+    try:
+        async with aiohttp.ClientSession(
+            timeout=timeout, trace_configs=[trace]
+        ) as session:
+            return await asyncio.gather(
+                *[limited_fetch(session, params, cb) for params, cb in queries]
+            )
+    finally:
+        url = urlparse(URL)
+        host = "{}://{}".format(url.scheme, url.netloc)
+        httpclient.add_stats(host, stats["requests"], stats["connections"])
+
+
+def get_many(queries):
+    """Run the queries [(params, callback), ...] concurrently
+    and return the results in the same order"""
+    if not queries:
+        return []
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(get_many_helper(queries))
+    # asyncio.run cannot be called from a running event loop
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, get_many_helper(queries)).result()
+
+
+def make_request(params, callback):
+    """Query Buildhub"""
+    return get_many([(params, callback)])[0]
+
+
+def get_query(
     min_buildid, channel, prods=["firefox", "fennec", "thunderbird"], max_buildid=None
 ):
-    """Get all builds info for buildids >= min_build"""
+    """Get the query (params, callback) for the builds with buildid >= min_build"""
     if isinstance(prods, six.string_types):
         prods = [prods]
     prods = [PRODS.get(x, x) for x in prods]
@@ -122,7 +191,14 @@ def get(
                     res_pc[bid] = {"revision": utils.short_rev(rev), "version": version}
         return res
 
-    return make_request(data, 1, 100, get_info)
+    return data, get_info
+
+
+def get(
+    min_buildid, channel, prods=["firefox", "fennec", "thunderbird"], max_buildid=None
+):
+    """Get all builds info for buildids >= min_build"""
+    return make_request(*get_query(min_buildid, channel, prods, max_buildid))
 
 
 def get_rev_from(buildid, channel, product):
@@ -146,7 +222,7 @@ def get_rev_from(buildid, channel, product):
     def cb(data):
         return utils.short_rev(data["aggregations"]["revisions"]["buckets"][0]["key"])
 
-    return make_request(data, 0.1, 100, cb)
+    return make_request(data, cb)
 
 
 def get_two_last(buildid, channel, product):
@@ -193,10 +269,41 @@ def get_two_last(buildid, channel, product):
 
         return bids
 
-    return make_request(data, 0.1, 100, get_info)
+    return make_request(data, get_info)
+
+
+def get_last_buildid(channel, product):
+    """Get the last buildid for a channel/product"""
+    product = PRODS.get(product, product)
+    data = {
+        "aggs": {
+            "buildids": {
+                "terms": {"field": "build.id", "size": 1, "order": {"_term": "desc"}}
+            }
+        },
+        "query": {
+            "bool": {
+                "filter": [
+                    {"term": {"target.channel": channel}},
+                    {"term": {"source.product": product}},
+                    {"regexp": {"target.version": VERSION_PATS.get(channel, "*")}},
+                ]
+            }
+        },
+        "size": 0,
+    }
+
+    def get_info(data):
+        data = data["aggregations"]["buildids"]["buckets"]
+        if len(data) == 0:
+            return None
+        return utils.get_build_date(data[0]["key"])
 
+    return make_request(data, get_info)
 
-async def get_enclosing_builds_helper(pushdate, channel, product):
+
+def get_enclosing_builds(pushdate, channel, product):
+    """Get the build before and the one after the given pushdate"""
     # TODO: we must handle the case where the timezone of buildid was not utc
     # check with jlorenzo when the changed has been made
     buildid = utils.get_buildid(pushdate)
@@ -239,22 +346,4 @@ async def get_enclosing_builds_helper(pushdate, channel, product):
         version = data["versions"]["buckets"][0]["key"]
         return {"buildid": bid, "revision": revision, "version": version}
 
-    loop = asyncio.get_event_loop()
-    fs = []
-    for d in data:
-        fs.append(
-            loop.run_in_executor(None, partial(make_request, d, 0.1, 100, get_info))
-        )
-    res = []
-    for f in fs:
-        res.append(await f)
-
-    return res
-
-
-def get_enclosing_builds(pushdate, channel, product):
-    """Get the build before and the one after the given pushdate"""
-    loop = asyncio.get_event_loop()
-    return loop.run_until_complete(
-        get_enclosing_builds_helper(pushdate, channel, product)
-    )
+    return get_many([(d, get_info) for d in data])
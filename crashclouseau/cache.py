@@ -0,0 +1,284 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from collections import defaultdict, OrderedDict
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class LRU(object):
+    """A process-local LRU cache"""
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        if key in self.data:
+            self.data.move_to_end(key)
+            return self.data[key]
+        return default
+
+    def get_many(self, keys):
+        res = {}
+        for key in keys:
+            if key in self.data:
+                self.data.move_to_end(key)
+                res[key] = self.data[key]
+        return res
+
+    def _put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.size:
+            self.data.popitem(last=False)
+
+    def put(self, key, value):
+        self._put(key, value)
+
+    def put_many(self, mapping):
+        for key, value in mapping.items():
+            self._put(key, value)
+
+    def clear(self):
+        self.data.clear()
+
+
+class RedisLRU(LRU):
+    """A process-local LRU cache backed by a Redis hash shared by all the workers.
+    The hash has at most size fields too: random ones are removed beyond."""
+
+    def __init__(self, size, conn, name, loads=lambda x: x, dumps=lambda x: x):
+        super(RedisLRU, self).__init__(size)
+        self.conn = conn
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        res = super(RedisLRU, self).get_many(keys)
+        missing = [k for k in keys if k not in res]
+        if missing:
+            values = self.conn.hmget(self.name, missing)
+            for key, value in zip(missing, values):
+                if value is not None:
+                    value = self.loads(value)
+                    res[key] = value
+                    self._put(key, value)
+        return res
+
+    def put(self, key, value):
+        self.put_many({key: value})
+
+    def put_many(self, mapping):
+        if mapping:
+            for key, value in mapping.items():
+                self._put(key, value)
+            self.conn.hset(
+                self.name, mapping={k: self.dumps(v) for k, v in mapping.items()}
+            )
+            self._trim()
+
+    def _trim(self):
+        excess = self.conn.hlen(self.name) - self.size
+        if excess > 0:
+            # the workers trim concurrently: some fields may be already removed
+            self.conn.hdel(self.name, *self.conn.hrandfield(self.name, excess))
+
+    def clear(self):
+        super(RedisLRU, self).clear()
+        self.conn.delete(self.name)
+
+
+class DiskCache(object):
+    """A cache of JSON values stored as gzipped files in a directory.
+    The least recently used files are removed when the total size exceeds max_size
+    and the values older than ttl seconds (if any) are expired."""
+
+    def __init__(self, path, max_size, ttl=None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = None
+        self.lock = threading.Lock()
+
+    def _get_path(self, key):
+        h = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, h[:2], h + ".json.gz")
+
+    def _get_files(self):
+        res = []
+        if not os.path.isdir(self.path):
+            return res
+        for root, _, files in os.walk(self.path):
+            for f in files:
+                if f.endswith(".json.gz"):
+                    path = os.path.join(root, f)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    res.append((st.st_mtime, st.st_size, path))
+        return res
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        path = self._get_path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as In:
+                data = json.load(In)
+            if self.ttl is not None and data["time"] + self.ttl < time.time():
+                self._remove(path)
+                return default
+            # the eviction removes the least recently used files first
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return default
+        return data["value"]
+
+    def put(self, key, value):
+        path = self._get_path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # write in a temporary file and rename it: a reader never gets a partial file
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                with gzip.open(f, "wt", encoding="utf-8") as Out:
+                    data = {"time": time.time(), "value": value}
+                    json.dump(data, Out, separators=(",", ":"))
+            new_size = os.path.getsize(tmp)
+            with self.lock:
+                # the file of the previous value (if any) is replaced
+                old_size = self._get_size(path)
+                os.replace(tmp, path)
+                if self.size is None:
+                    self.size = sum(size for _, size, _ in self._get_files())
+                else:
+                    self.size += new_size - old_size
+                if self.size > self.max_size:
+                    self._evict()
+        except Exception:
+            self._remove(tmp)
+            raise
+
+    def delete(self, key):
+        path = self._get_path(key)
+        with self.lock:
+            size = self._get_size(path)
+            self._remove(path)
+            if self.size is not None:
+                self.size -= size
+
+    def _get_size(self, path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _evict(self):
+        files = sorted(self._get_files())
+        self.size = sum(size for _, size, _ in files)
+        # remove a bit more than needed to avoid to evict on each put
+        target = 0.9 * self.max_size
+        for _, size, path in files:
+            if self.size <= target:
+                break
+            self._remove(path)
+            self.size -= size
+
+    def clear(self):
+        with self.lock:
+            for _, _, path in self._get_files():
+                self._remove(path)
+            self.size = 0
+
+
+class TTLCache(object):
+    """A process-local cache where each value has its own time to live.
+    The least recently used values are removed when the cache is full."""
+
+    def __init__(self, size):
+        self.lru = LRU(size)
+        self.stats = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.lru.get(key)
+            if value is None:
+                return default
+            expiry, value = value
+            if expiry < time.time():
+                del self.lru.data[key]
+                return default
+            return value
+
+    def put(self, key, value, ttl):
+        with self.lock:
+            self.lru.put(key, (time.time() + ttl, value))
+
+    def incr(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def clear(self):
+        with self.lock:
+            self.lru.clear()
+            self.stats.clear()
+
+
+class RedisTTLCache(object):
+    """A cache in Redis shared by all the workers: the values expire with their keys"""
+
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.stats_key = name + ":stats"
+
+    def get(self, key, default=None):
+        value = self.conn.get(self.name + ":" + key)
+        return default if value is None else value.decode("utf-8")
+
+    def put(self, key, value, ttl):
+        self.conn.set(self.name + ":" + key, value, ex=ttl)
+
+    def incr(self, name):
+        self.conn.hincrby(self.stats_key, name, 1)
+
+    def get_stats(self):
+        return {
+            k.decode("utf-8"): int(v)
+            for k, v in self.conn.hgetall(self.stats_key).items()
+        }
+
+    def clear(self):
+        for key in self.conn.scan_iter(match=self.name + ":*"):
+            self.conn.delete(key)
@@ -70,6 +70,115 @@ def get_num_lines():
     return _get_global()["score"]["number_of_lines"]
 
 
+def get_signature_cache_size():
+    return _get_global()["signature_cache"]["size"]
+
+
+def use_redis_for_signature_cache():
+    return _get_global()["signature_cache"]["redis"]
+
+
+def get_supersearch_cache_size():
+    return _get_global()["supersearch_cache"]["size"]
+
+
+def use_redis_for_supersearch_cache():
+    return _get_global()["supersearch_cache"]["redis"]
+
+
+def get_supersearch_cache_ttl(kind):
+    ttls = _get_global()["supersearch_cache"]["ttl"]
+    return ttls.get(kind, ttls["default"])
+
+
+def get_report_workers():
+    return _get_global()["reports"]["workers"]
+
+
+def get_report_batch_size():
+    return _get_global()["reports"]["batch_size"]
+
+
+def get_report_lease():
+    return _get_global()["reports"]["lease"]
+
+
+def get_patch_workers():
+    return _get_global()["patches"]["workers"]
+
+
+def get_patch_batch_size():
+    return _get_global()["patches"]["batch_size"]
+
+
+def get_patch_lease():
+    return _get_global()["patches"]["lease"]
+
+
+def get_patch_max_errors():
+    return _get_global()["patches"]["max_errors"]
+
+
+def get_patch_cache_path():
+    return _get_global()["patch_cache"]["path"]
+
+
+def get_patch_cache_max_size():
+    return _get_global()["patch_cache"]["max_size"]
+
+
+def get_crash_store_path():
+    return _get_global()["crash_store"]["path"]
+
+
+def get_crash_store_max_size():
+    return _get_global()["crash_store"]["max_size"]
+
+
+def get_crash_store_ttl():
+    return _get_global()["crash_store"]["ttl"]
+
+
+def get_crash_prefetch_workers():
+    return _get_global()["crash_store"]["prefetch_workers"]
+
+
+def get_http_pool_connections():
+    return _get_global()["http"]["pool_connections"]
+
+
+def get_http_pool_maxsize():
+    return _get_global()["http"]["pool_maxsize"]
+
+
+def get_http_timeout():
+    return _get_global()["http"]["timeout"]
+
+
+def get_http_retries():
+    return _get_global()["http"]["retries"]
+
+
+def get_http_backoff_factor():
+    return _get_global()["http"]["backoff_factor"]
+
+
+def get_buildhub_workers():
+    return _get_global()["buildhub"]["workers"]
+
+
+def get_buildhub_retries():
+    return _get_global()["buildhub"]["retries"]
+
+
+def get_buildhub_backoff_factor():
+    return _get_global()["buildhub"]["backoff_factor"]
+
+
+def get_buildhub_max_backoff():
+    return _get_global()["buildhub"]["max_backoff"]
+
+
 def get_database():
     return _get_local().get("database", "")
 
@@ -78,6 +187,14 @@ def get_redis():
     return _get_local().get("redis", "")
 
 
+def get_hg_backend():
+    return _get_local().get("hg_backend", "http")
+
+
+def get_hg_repositories():
+    return _get_local().get("hg_repositories", {})
+
+
 def get_socorro():
     return _get_local().get("socorro", "")
 
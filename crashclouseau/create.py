@@ -4,6 +4,7 @@
 
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+import itertools
 import json
 from libmozdata import utils as lmdutils
 import pytz
@@ -34,10 +35,11 @@ def create(date=None, extra={}, hgauthors={}):
 
     start_date = date - relativedelta(days=config.get_ndays_of_data())
     logger.info("Create data for {}: started.".format(date))
+    update.refresh(config.get_channels())
     for chan in config.get_channels():
         update.put_filelog(chan, start_date=start_date, end_date=date)
-        for prod in config.get_products():
-            update.update_builds(start_date + relativedelta(days=1), chan, prod)
+    pairs = list(itertools.product(config.get_channels(), config.get_products()))
+    update.update_all_builds(start_date + relativedelta(days=1), pairs)
 
     if isinstance(extra, six.string_types):
         extra = json.loads(extra)
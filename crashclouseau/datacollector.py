@@ -8,12 +8,19 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import functools
 from libmozdata import socorro, utils as lmdutils
-from libmozdata.connection import Connection, Query
+from libmozdata.connection import Query
 import re
-from . import config, models, utils
+import threading
+from urllib.parse import urlencode
+from . import config, models, supersearch, utils
 from .logger import logger
 
 
+# the max length of the url of a query: the signatures are in the url and
+# the servers answer 414 beyond 8KB (minus a margin for the request line)
+MAX_URL_LENGTH = 8000
+
+
 def get_builds(product, channel, date):
     """Get the buildids for a product/channel prior to date"""
     if channel == "nightly":
@@ -67,55 +74,62 @@ def get_buildids_from_socorro(search_buildid, search_date, product):
     }
 
     data = []
-    socorro.SuperSearch(params=params, handler=handler, handlerdata=data).wait()
+    supersearch.search(
+        params=params, handler=handler, handlerdata=data, kind="buildids"
+    ).wait()
 
     data = sorted(data)
 
     return data
 
 
-def get_new_signatures(product, channel, date):
-    """Get the new signatures. In nightly that means that we collect
-    only signatures with no crashes in last few days"""
+def get_last_crash_date(product, channel):
+    """Get the date of the last crash received by Socorro"""
 
-    limit = config.get_limit_facets()
-    bids, search_date = get_builds(product, channel, date)
-    if not bids:
-        logger.warning("No buildids for {}-{}.".format(product, channel))
-        return {}
+    def handler(json, data):
+        if json["hits"]:
+            data.append(lmdutils.get_date_ymd(json["hits"][0]["date"]))
 
-    base = {}
-    for bid in bids:
-        bid = utils.get_build_date(bid)
-        day = datetime(bid.year, bid.month, bid.day)
-        if day not in base:
-            base[day] = {"installs": {}, "bids": {}, "count": 0}
-        base[day]["bids"][bid] = 0
+    params = {
+        "product": product,
+        "release_channel": utils.get_search_channel(channel),
+        "date": ">=" + lmdutils.get_date_str(datetime.utcnow() - relativedelta(days=7)),
+        "_sort": "-date",
+        "_columns": "date",
+        "_results_number": 1,
+        "_facets": "release_channel",
+    }
+
+    data = []
+    supersearch.search(
+        params=params, handler=handler, handlerdata=data, kind="last_crash"
+    ).wait()
+
+    return data[0] if data else None
 
-    logger.info("Get crash numbers for {}-{}: started.".format(product, channel))
 
-    def handler(base, json, data):
+def get_crash_numbers(product, channel, bids, search_date):
+    """Get the crash numbers and the installs by signature for each build"""
+    limit = config.get_limit_facets()
+
+    def handler(json, data):
         if json["errors"]:
             raise Exception(
                 "Error in json data from SuperSearch: {}".format(json["errors"])
             )
         if not json["facets"]["signature"]:
             return
-        for facets in json["facets"]["signature"]:
-            installs = facets["facets"]["cardinality_install_time"]["value"]
-            sgn = facets["term"]
-            bid_info = facets["facets"]["build_id"][0]
-            count = bid_info["count"]
-            bid = bid_info["term"]
-            bid = utils.get_build_date(bid)
-            day = datetime(bid.year, bid.month, bid.day)
-            if sgn in data:
-                numbers = data[sgn]
-            else:
-                data[sgn] = numbers = copy.deepcopy(base)
-            numbers[day]["count"] += count
-            numbers[day]["bids"][bid] = count
-            numbers[day]["installs"][bid] = 1 if installs == 0 else installs
+        # the handlers are called from the threads running the queries
+        with lock:
+            for facets in json["facets"]["signature"]:
+                installs = facets["facets"]["cardinality_install_time"]["value"]
+                bid_info = facets["facets"]["build_id"][0]
+                data.add(
+                    facets["term"],
+                    bid_info["term"],
+                    bid_info["count"],
+                    1 if installs == 0 else installs,
+                )
         del json
 
     params = {
@@ -129,19 +143,44 @@ def get_new_signatures(product, channel, date):
         "_facets_size": limit,
     }
 
-    data = {}
-    hdler = functools.partial(handler, base)
+    data = utils.CrashNumbers(bids)
+    lock = threading.Lock()
+    queries = []
     for bid in bids:
+        params = copy.deepcopy(params)
         params["build_id"] = bid
-        socorro.SuperSearch(params=params, handler=hdler, handlerdata=data).wait()
+        queries.append(
+            Query(
+                socorro.SuperSearch.URL,
+                params=params,
+                handler=handler,
+                handlerdata=data,
+            )
+        )
+    supersearch.search(queries=queries, kind="crash_numbers").wait()
+
+    return data
+
+
+def get_new_signatures(product, channel, date):
+    """Get the new signatures. In nightly that means that we collect
+    only signatures with no crashes in last few days"""
+
+    bids, search_date = get_builds(product, channel, date)
+    if not bids:
+        logger.warning("No buildids for {}-{}.".format(product, channel))
+        return {}
+
+    logger.info("Get crash numbers for {}-{}: started.".format(product, channel))
+
+    data = get_crash_numbers(product, channel, bids, search_date)
 
     shift = config.get_ndays() if channel == "nightly" else 1
     threshold = config.get_threshold("installs", product, channel)
     big_data = {}
     small_data = {}
 
-    for sgn, numbers in data.items():
-        bids, big = utils.get_new_crashing_bids(numbers, shift, threshold)
+    for sgn, (bids, big) in data.get_new_crashing_bids(shift, threshold).items():
         if bids:
             d = {
                 "bids": bids,
@@ -152,8 +191,6 @@ def get_new_signatures(product, channel, date):
                 big_data[sgn] = d
             else:
                 small_data[sgn] = d
-        else:
-            data[sgn] = None
 
     del data
 
@@ -178,12 +215,13 @@ def get_proto_small(product, signatures, search_date, channel):
     """Get the proto-signatures for signature with a small number of crashes.
     Since we 'must' aggregate uuid on proto-signatures, to be faster we query
     several signatures: it's possible because we know that card(proto) <= card(crashes)
-    for a given signature."""
+    for a given signature. So the signatures are packed in a query while the sum
+    of their crash numbers fits in the facets limit."""
     logger.info(
         "Get proto-signatures (small) for {}-{}: started.".format(product, channel)
     )
 
-    def handler(bid, threshold, json, data):
+    def handler(bid, json, data):
         if not json["facets"]["proto_signature"]:
             return
         for facets in json["facets"]["proto_signature"]:
@@ -200,6 +238,10 @@ def get_proto_small(product, signatures, search_date, channel):
             count = facets["facets"]["cardinality_install_time"]["value"]
             data[sgn]["installs"][bid] = 1 if count == 0 else count
 
+    def is_truncated(json, sgns):
+        # the crash numbers may have changed since we got them
+        return len(json["facets"]["proto_signature"]) >= limit
+
     limit = config.get_limit_facets()
     threshold = config.get_threshold("protos", product, channel)
     base_params = {
@@ -215,50 +257,120 @@ def get_proto_small(product, signatures, search_date, channel):
         "_facets_size": limit,
     }
 
-    sgns_by_bids = utils.get_sgns_by_bids(signatures)
-    for bid, all_signatures in sgns_by_bids.items():
-        params = copy.deepcopy(base_params)
-        params["build_id"] = utils.get_buildid(bid)
+    plan = plan_queries(signatures, limit, base_params, budget=limit)
+    logger.info(
+        "Get proto-signatures (small) for {}-{}: {} queries for {} signatures.".format(
+            product, channel, len(plan), len(signatures)
+        )
+    )
+    send_queries(plan, base_params, handler, signatures, is_truncated)
+
+    logger.info(
+        "Get proto-signatures (small) for {}-{}: finished.".format(product, channel)
+    )
+
+
+def get_url_length(params):
+    """Get the length of the url of a SuperSearch query"""
+    return len(socorro.SuperSearch.URL) + 1 + len(urlencode(params, doseq=True))
+
+
+def get_signature_length(sgn):
+    """Get the length of the signature param in the url (with its &)"""
+    return len(urlencode({"signature": "=" + sgn})) + 1
+
+
+def plan_queries(signatures, size, base_params, budget=None):
+    """Get the queries to send for the signatures: a list of (bid, signatures)
+    with at most size signatures in each query and, if budget is set,
+    with at most budget crashes (so at most budget proto-signatures).
+    The url of a query with the base_params is at most MAX_URL_LENGTH long."""
+    plan = []
+    for bid, all_signatures in utils.get_sgns_by_bids(signatures).items():
+        params = dict(base_params, build_id=utils.get_buildid(bid), signature=[])
+        length = MAX_URL_LENGTH - get_url_length(params)
+        limits = [(length, get_signature_length)]
+        if budget is None:
+            all_signatures = sorted(all_signatures)
+        else:
+            # the crash numbers are known for the new crashing builds
+            counts = {sgn: signatures[sgn]["bids"][bid] for sgn in all_signatures}
+            all_signatures = sorted(all_signatures, key=lambda s: (-counts[s], s))
+            limits.append((budget, counts.get))
+        for sgns in utils.pack(all_signatures, size, limits):
+            plan.append((bid, sgns))
+    return plan
+
+
+def send_queries(plan, base_params, handler, data, is_truncated=None):
+    """Send the queries for the plan [(bid, signatures), ...]: the handler
+    is called with the bid. When the results of a query are truncated,
+    its signatures are split in two queries which are sent again."""
+    truncated = []
+
+    def hdler(bid, sgns, json, data):
+        if is_truncated and len(sgns) > 1 and is_truncated(json, sgns):
+            truncated.append((bid, sgns))
+        else:
+            handler(bid, json, data)
+
+    while plan:
         queries = []
-        hdler = functools.partial(handler, bid, threshold)
-        for sgns in Connection.chunks(all_signatures, 5):
-            params = copy.deepcopy(params)
+        for bid, sgns in plan:
+            params = copy.deepcopy(base_params)
+            params["build_id"] = utils.get_buildid(bid)
             params["signature"] = ["=" + s for s in sgns]
             queries.append(
                 Query(
                     socorro.SuperSearch.URL,
                     params=params,
-                    handler=hdler,
-                    handlerdata=signatures,
+                    handler=functools.partial(hdler, bid, sgns),
+                    handlerdata=data,
                 )
             )
+        supersearch.search(queries=queries, kind="protos").wait()
 
-        socorro.SuperSearch(queries=queries).wait()
-
-    logger.info(
-        "Get proto-signatures (small) for {}-{}: finished.".format(product, channel)
-    )
+        plan = []
+        for bid, sgns in truncated:
+            logger.info(
+                "Truncated results for {} signatures: split the query.".format(
+                    len(sgns)
+                )
+            )
+            middle = len(sgns) // 2
+            plan += [(bid, sgns[:middle]), (bid, sgns[middle:])]
+        del truncated[:]
 
 
 def get_proto_big(product, signatures, search_date, channel):
-    """Get proto-signatures for signatures which have a high # of crashes (>=500)"""
+    """Get proto-signatures for signatures which have a high # of crashes (>=500).
+    Several signatures are packed in a query and the proto-signatures are
+    aggregated by signature. The installs are counted in other queries:
+    SuperSearch has only one aggregation by first-level field."""
     logger.info(
         "Get proto-signatures (big) for {}-{}: started.".format(product, channel)
     )
 
-    def handler(bid, threshold, json, data):
-        if not json["facets"]["proto_signature"]:
+    def handler(bid, json, data):
+        if not json["facets"]["signature"]:
             return
-        installs = json["facets"]["cardinality_install_time"]["value"]
-        data["installs"][bid] = 1 if installs == 0 else installs
-        for facets in json["facets"]["proto_signature"]:
-            protos = data["protos"][bid]
-            if len(protos) < threshold:
-                proto = facets["term"]
-                count = facets["count"]
-                uuid = facets["facets"]["uuid"][0]["term"]
-                protos.append({"proto": proto, "count": count, "uuid": uuid})
+        for sgn_facets in json["facets"]["signature"]:
+            protos = data[sgn_facets["term"]]["protos"][bid]
+            for proto_facets in sgn_facets["facets"]["proto_signature"]:
+                if len(protos) < threshold:
+                    proto = proto_facets["term"]
+                    count = proto_facets["count"]
+                    uuid = proto_facets["facets"]["uuid"][0]["term"]
+                    protos.append({"proto": proto, "count": count, "uuid": uuid})
+
+    def installs_handler(bid, json, data):
+        if not json["facets"]["signature"]:
+            return
+        for facets in json["facets"]["signature"]:
+            installs = facets["facets"]["cardinality_install_time"]["value"]
+            data[facets["term"]]["installs"][bid] = 1 if installs == 0 else installs
 
+    limit = config.get_limit_facets()
     threshold = config.get_threshold("protos", product, channel)
     base_params = {
         "product": product,
@@ -266,31 +378,31 @@ def get_proto_big(product, signatures, search_date, channel):
         "date": search_date,
         "build_id": "",
         "signature": "",
-        "_aggs.proto_signature": "uuid",
         "_results_number": 0,
-        "_facets": "_cardinality.install_time",
+        "_facets": "release_channel",
+    }
+    # the facets size applies to the signatures and to their proto-signatures:
+    # with at most threshold signatures in a query, none of them is dropped
+    protos_params = {
+        **base_params,
+        "_aggs.signature.proto_signature": "uuid",
         "_facets_size": threshold,
     }
+    installs_params = {
+        **base_params,
+        "_aggs.signature": "_cardinality.install_time",
+        "_facets_size": limit,
+    }
 
-    sgns_by_bids = utils.get_sgns_by_bids(signatures)
-    for bid, all_signatures in sgns_by_bids.items():
-        params = copy.deepcopy(base_params)
-        params["build_id"] = utils.get_buildid(bid)
-        queries = []
-        hdler = functools.partial(handler, bid, threshold)
-        for sgn in all_signatures:
-            params = copy.deepcopy(params)
-            params["signature"] = "=" + sgn
-            queries.append(
-                Query(
-                    socorro.SuperSearch.URL,
-                    params=params,
-                    handler=hdler,
-                    handlerdata=signatures[sgn],
-                )
-            )
-
-        socorro.SuperSearch(queries=queries).wait()
+    plan = plan_queries(signatures, threshold, protos_params)
+    installs_plan = plan_queries(signatures, limit, installs_params)
+    logger.info(
+        "Get proto-signatures (big) for {}-{}: {} queries for {} signatures.".format(
+            product, channel, len(plan) + len(installs_plan), len(signatures)
+        )
+    )
+    send_queries(plan, protos_params, handler, signatures)
+    send_queries(installs_plan, installs_params, installs_handler, signatures)
 
     logger.info(
         "Get proto-signatures (big) for {}-{}: finished.".format(product, channel)
@@ -301,11 +413,9 @@ def get_uuids_fennec(signatures, search_date, channel):
     """Get the uuids for Fennec java crashes"""
     logger.info("Get uuids for Fennec-{}: started.".format(channel))
 
-    def handler(json, data):
+    def handler(bid, json, data):
         if json["errors"] or not json["facets"]["signature"]:
             return
-        bid = json["facets"]["build_id"][0]["term"]
-        bid = utils.get_build_date(bid)
         for facets in json["facets"]["signature"]:
             sgn = facets["term"]
             count = facets["count"]
@@ -315,6 +425,11 @@ def get_uuids_fennec(signatures, search_date, channel):
             if not protos:
                 protos.append({"proto": "", "count": count, "uuid": uuid})
 
+    def is_truncated(json, sgns):
+        facets = json["facets"]["signature"]
+        return len(facets) >= size and len(facets) < len(sgns)
+
+    size = 100
     base_params = {
         "product": "Fennec",
         "release_channel": utils.get_search_channel(channel),
@@ -323,29 +438,12 @@ def get_uuids_fennec(signatures, search_date, channel):
         "signature": "",
         "_aggs.signature": "uuid",
         "_results_number": 0,
-        "_facets": "build_id",
-        "_facets_size": 100,
+        "_facets": "release_channel",
+        "_facets_size": size,
     }
 
-    queries = []
-    sgns_by_bids = utils.get_sgns_by_bids(signatures)
-
-    for bid, all_signatures in sgns_by_bids.items():
-        params = copy.deepcopy(base_params)
-        params["build_id"] = utils.get_buildid(bid)
-
-        for sgns in Connection.chunks(all_signatures, 10):
-            params = copy.deepcopy(params)
-            params["signature"] = ["=" + s for s in sgns]
-            queries.append(
-                Query(
-                    socorro.SuperSearch.URL,
-                    params=params,
-                    handler=handler,
-                    handlerdata=signatures,
-                )
-            )
-    socorro.SuperSearch(queries=queries).wait()
+    plan = plan_queries(signatures, size, base_params)
+    send_queries(plan, base_params, handler, signatures, is_truncated)
 
     logger.info("Get uuids for Fennec-{}: finished.".format(channel))
 
@@ -381,7 +479,9 @@ def get_changeset(buildid, channel, product):
     }
 
     data = defaultdict(lambda: 0)
-    socorro.SuperSearch(params=params, handler=handler, handlerdata=data).wait()
+    supersearch.search(
+        params=params, handler=handler, handlerdata=data, kind="changeset"
+    ).wait()
     chgset = None
     if data:
         chgset, _ = max(data.items(), key=lambda p: p[1])
@@ -0,0 +1,185 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from dateutil.relativedelta import relativedelta
+from libmozdata.hgmozilla import Mercurial, RawRevision
+from libmozdata import utils as lmdutils
+from parsepatch.patch import Patch
+import pytz
+from . import config, httpclient, utils
+
+
+__BACKEND = None
+
+
+class HTTPBackend(object):
+    """Get the pushlog and the patches from hg.mozilla.org"""
+
+    def get_pushes(self, channel, params, full=True):
+        """Get the pushes as returned by json-pushes (version 2)"""
+        url = "{}/json-pushes".format(Mercurial.get_repo_url(channel))
+        params = dict(params, version=2)
+        if full:
+            params["full"] = 1
+        r = httpclient.get(url, params=params)
+        return r.json()
+
+    def get_pushes_by_date(self, startdate, enddate, channel):
+        """Get the pushes where startdate <= pushdate <= enddate"""
+        # pushlog uses strict inequality, it's why we add +/- 1 second
+        fmt = "%Y-%m-%d %H:%M:%S"
+        startdate -= relativedelta(seconds=1)
+        enddate += relativedelta(seconds=1)
+        params = {
+            "startdate": startdate.strftime(fmt),
+            "enddate": enddate.strftime(fmt),
+        }
+        return self.get_pushes(channel, params)
+
+    def get_pushes_by_revs(self, startrev, endrev, channel):
+        """Get the pushes from startrev (excluded) to endrev"""
+        params = {"fromchange": startrev, "tochange": endrev}
+        return self.get_pushes(channel, params)
+
+    def refresh(self, channel):
+        """Nothing to do: hg.mozilla.org is always up to date"""
+        pass
+
+    def get_last_pushdate(self, channel):
+        """Get the date of the last push"""
+        # without a range, json-pushes returns the last pushes:
+        # the dates are enough, not the changesets with their files
+        data = self.get_pushes(channel, {"tipsonly": 1}, full=False)
+        dates = [push["date"] for push in data["pushes"].values()]
+        return lmdutils.get_date_from_timestamp(max(dates)) if dates else None
+
+    def parse_patch(self, chgset, channel):
+        """Get and parse the patch for the revision chgset"""
+        url = "{}/{}".format(RawRevision.get_url(channel), chgset)
+        r = httpclient.get(url)
+        # an error page must not be parsed (and cached) as an empty patch
+        r.raise_for_status()
+        return Patch.parse_patch(
+            r.text, file_filter=utils.is_interesting_file, skip_comments=True
+        )
+
+
+class LocalBackend(object):
+    """Get the pushlog and the patches from local clones.
+    The pushlog extension (from version-control-tools) must be enabled
+    to have the push data in the clones."""
+
+    ENTRIES = [
+        "pushid",
+        "pushdate|hgdate",
+        "node",
+        "author",
+        "desc",
+        "p1node",
+        "p2node",
+        'join(files, "\\n")',
+    ]
+    NULLID = "0" * 40
+
+    def __init__(self, repositories, pull=True):
+        self.repositories = repositories
+        self.pull = pull
+        template = "\\0".join("{" + e + "}" for e in LocalBackend.ENTRIES) + "\\0"
+        self.template = bytes(template, "utf-8")
+
+    def run(self, channel, cmd, **kwargs):
+        import hglib
+
+        with hglib.open(self.repositories[channel]) as client:
+            return client.rawcommand(hglib.util.cmdbuilder(cmd, **kwargs))
+
+    def refresh(self, channel):
+        """Pull the new pushes in the clone for the channel: it's done once
+        per update run (see update.refresh) and not before each query"""
+        if self.pull:
+            self.run(channel, b"pull")
+
+    def get_pushes(self, channel, revset):
+        """Get the pushes for the revisions in revset (as returned by json-pushes)"""
+        out = self.run(channel, b"log", r=revset, template=self.template)
+        out = out.decode("utf-8").split("\0")
+        N = len(LocalBackend.ENTRIES)
+        pushes = {}
+        for i in range(0, len(out) - 1, N):
+            pushid, pushdate, node, author, desc, p1node, p2node, files = out[
+                i:(i + N)
+            ]
+            if pushid not in pushes:
+                # hgdate is "timestamp offset"
+                pushes[pushid] = {
+                    "date": int(pushdate.split(" ")[0]),
+                    "changesets": [],
+                }
+            pushes[pushid]["changesets"].append(
+                {
+                    "node": node,
+                    "author": author,
+                    "desc": desc,
+                    "parents": [
+                        p for p in [p1node, p2node] if p != LocalBackend.NULLID
+                    ],
+                    "files": list(filter(None, files.split("\n"))),
+                }
+            )
+        return {"pushes": pushes}
+
+    def get_pushes_by_date(self, startdate, enddate, channel):
+        """Get the pushes where startdate <= pushdate <= enddate"""
+        fmt = "%Y-%m-%d %H:%M:%S +0000"
+        startdate = startdate.astimezone(pytz.utc).strftime(fmt)
+        enddate = enddate.astimezone(pytz.utc).strftime(fmt)
+        revset = 'pushdate("{} to {}")'.format(startdate, enddate)
+        return self.get_pushes(channel, revset)
+
+    def get_pushid(self, channel, rev):
+        """Get the id of the push of the revision (None if it hasn't been pushed)"""
+        out = self.run(channel, b"log", r=rev, template=b"{pushid}")
+        out = out.decode("utf-8")
+        return int(out) if out else None
+
+    def get_pushes_by_revs(self, startrev, endrev, channel):
+        """Get the pushes from startrev (excluded) to endrev"""
+        # as json-pushes, select the pushes in the range of pushes
+        # and not the ancestors of endrev
+        start = self.get_pushid(channel, startrev)
+        end = self.get_pushid(channel, endrev)
+        if start is None or end is None or start >= end:
+            return {"pushes": {}}
+        revset = " or ".join(
+            "pushid({})".format(pushid) for pushid in range(start + 1, end + 1)
+        )
+        return self.get_pushes(channel, revset)
+
+    def get_last_pushdate(self, channel):
+        """Get the date of the last push"""
+        out = self.run(channel, b"log", r="tip", template=b"{pushdate|hgdate}")
+        out = out.decode("utf-8")
+        if not out:
+            return None
+        return lmdutils.get_date_from_timestamp(int(out.split(" ")[0]))
+
+    def parse_patch(self, chgset, channel):
+        """Get and parse the patch for the revision chgset"""
+        out = self.run(channel, b"export", r=chgset, git=True)
+        return Patch.parse_patch(
+            out.decode("utf-8", "replace"),
+            file_filter=utils.is_interesting_file,
+            skip_comments=True,
+        )
+
+
+def get_backend():
+    """Get the backend set in the configuration"""
+    global __BACKEND
+    if __BACKEND is None:
+        if config.get_hg_backend() == "local":
+            __BACKEND = LocalBackend(config.get_hg_repositories())
+        else:
+            __BACKEND = HTTPBackend()
+    return __BACKEND
@@ -0,0 +1,140 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .logger import logger
+from . import config
+
+
+# Error 429 is for 'Too many requests' and the 5xx are server errors
+STATUS_FORCELIST = [429, 500, 502, 503, 504]
+# the queries are idempotent: they can be retried
+ALLOWED_METHODS = ["GET", "HEAD"]
+# host => number of requests and of opened connections in all the processes
+STATS_KEY = "clouseau:http:stats"
+__SESSION = None
+__PID = None
+__LOCK = threading.Lock()
+# host => [requests, connections] already added to the stats in Redis
+__PUBLISHED = {}
+
+
+def make_session():
+    """Make a session keeping the connections alive in a pool for each host"""
+    retries = Retry(
+        total=config.get_http_retries(),
+        backoff_factor=config.get_http_backoff_factor(),
+        status_forcelist=STATUS_FORCELIST,
+        allowed_methods=ALLOWED_METHODS,
+        # the callers check the status of the last response
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=config.get_http_pool_connections(),
+        pool_maxsize=config.get_http_pool_maxsize(),
+        max_retries=retries,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """Get the session for this process"""
+    global __SESSION, __PID, __PUBLISHED
+    # the workers fork: the connections mustn't be shared with the parent
+    pid = os.getpid()
+    if __SESSION is None or __PID != pid:
+        with __LOCK:
+            if __SESSION is None or __PID != pid:
+                __SESSION = make_session()
+                __PID = pid
+                __PUBLISHED = {}
+    return __SESSION
+
+
+def request(method, url, **kwargs):
+    kwargs.setdefault("timeout", tuple(config.get_http_timeout()))
+    try:
+        return get_session().request(method, url, **kwargs)
+    finally:
+        publish_stats()
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def get_local_stats():
+    """Get the number of requests and of opened connections by host
+    for this process"""
+    stats = {}
+    if __SESSION is None or __PID != os.getpid():
+        return stats
+    adapters = set(__SESSION.adapters.values())
+    for adapter in adapters:
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = "{}://{}".format(key.key_scheme, key.key_host)
+            if key.key_port:
+                host += ":{}".format(key.key_port)
+            s = stats.setdefault(host, [0, 0])
+            s[0] += pool.num_requests
+            s[1] += pool.num_connections
+    return stats
+
+
+def add_stats(host, requests, connections):
+    """Add some requests and opened connections to the stats of all the processes"""
+    from .worker import conn
+
+    try:
+        if requests:
+            conn.hincrby(STATS_KEY, host + ":requests", requests)
+        if connections:
+            conn.hincrby(STATS_KEY, host + ":connections", connections)
+    except Exception as e:
+        # the stats mustn't make the requests fail
+        logger.warning("Cannot update the HTTP stats: {}".format(e))
+
+
+def publish_stats():
+    """Add the requests of this process done since the last call to the stats"""
+    with __LOCK:
+        deltas = []
+        for host, current in get_local_stats().items():
+            published = __PUBLISHED.setdefault(host, [0, 0])
+            deltas.append(
+                (host, current[0] - published[0], current[1] - published[1])
+            )
+            published[:] = current
+    for delta in deltas:
+        add_stats(*delta)
+
+
+def get_stats():
+    """Get the number of requests and of opened connections by host
+    for all the processes (the web app and the workers)"""
+    from .worker import conn
+
+    stats = {}
+    for name, n in conn.hgetall(STATS_KEY).items():
+        host, what = name.decode("utf-8").rsplit(":", 1)
+        s = stats.setdefault(host, {"requests": 0, "connections": 0})
+        s[what] = int(n)
+    for s in stats.values():
+        s["reused"] = max(0, s["requests"] - s["connections"])
+    return stats
@@ -3,25 +3,129 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from libmozdata import socorro
+from libmozdata.connection import Query
 import re
-from . import java, tools, utils
+from . import cache, config, java, tools, utils
 from .logger import logger
 
 
 # Mercurial URI
 HG_PAT = re.compile("hg:hg.mozilla.org[^:]*:([^:]*):([a-z0-9]+)")
+MAX_FRAMES = 50
+__STORE = None
+
+
+def get_crash_store():
+    """Get the on-disk store uuid => compacted crash data (None if disabled)"""
+    global __STORE
+    if __STORE is None:
+        path = config.get_crash_store_path()
+        if path:
+            __STORE = cache.DiskCache(
+                path, config.get_crash_store_max_size(), config.get_crash_store_ttl()
+            )
+    return __STORE
+
+
+def compact_crash(data):
+    """Keep only the crash data used in the inspection.
+    The crashing thread is the only one kept (and is the thread 0)."""
+    res = {
+        k: data[k]
+        for k in ["build", "release_channel", "product", "java_stack_trace"]
+        if k in data
+    }
+    if "json_dump" in data:
+        dump = data["json_dump"]
+        res["json_dump"] = compact_dump = {}
+        if "threads" in dump:
+            compact_dump["crash_info"] = {}
+            compact_dump["threads"] = []
+            N = dump["crash_info"].get("crashing_thread")
+            if N is not None:
+                frames = [
+                    {
+                        k: frame[k]
+                        for k in ["file", "function", "line", "module"]
+                        if k in frame
+                    }
+                    for frame in dump["threads"][N]["frames"][0:MAX_FRAMES]
+                ]
+                compact_dump["crash_info"]["crashing_thread"] = 0
+                compact_dump["threads"].append({"frames": frames})
+    return res
 
 
 def get_crash_data(uuid):
-    """Get the crash data from Socorro"""
+    """Get the crash data from the local store or from Socorro"""
+    store = get_crash_store()
+    if store is not None:
+        data = store.get(uuid)
+        if data is not None:
+            return data
+
     data = socorro.ProcessedCrash.get_processed(uuid)
-    return data[uuid]
+    data = compact_crash(data[uuid])
+    if store is not None:
+        store.put(uuid, data)
+    return data
 
 
-def get_crash(uuid, buildid, channel, mindate, chgset, filelog, interesting_chgsets):
+class ProcessedCrash(socorro.ProcessedCrash):
+    # the number of concurrent requests to Socorro
+    MAX_WORKERS = config.get_crash_prefetch_workers()
+
+
+def get_crashes_data(uuids):
+    """Get the crash data for several crashes: uuid => data.
+    The crashes which aren't in the local store are retrieved concurrently,
+    the ones which cannot be retrieved are missing in the result."""
+    store = get_crash_store()
+    res = {}
+    if store is not None:
+        for uuid in uuids:
+            data = store.get(uuid)
+            if data is not None:
+                res[uuid] = data
+
+    missing = [uuid for uuid in uuids if uuid not in res]
+    if not missing:
+        return res
+
+    logger.info("Get {} crashes from Socorro".format(len(missing)))
+    data = {uuid: {} for uuid in missing}
+    queries = [
+        Query(
+            ProcessedCrash.URL,
+            {"crash_id": uuid, "datatype": "processed"},
+            ProcessedCrash.default_handler,
+            data[uuid],
+        )
+        for uuid in missing
+    ]
+    try:
+        ProcessedCrash(queries=queries, raise_error=False).wait()
+    except Exception as e:
+        logger.error(e, exc_info=True)
+
+    for uuid, crash in data.items():
+        # an empty dict means that the query failed
+        if crash:
+            crash = compact_crash(crash)
+            if store is not None:
+                store.put(uuid, crash)
+            res[uuid] = crash
+
+    return res
+
+
+def get_crash(
+    uuid, buildid, channel, mindate, chgset, filelog, interesting_chgsets, data=None
+):
     """Get the a crash with its uuid"""
     logger.info("Get {} for analyzis".format(uuid))
-    data = get_crash_data(uuid)
+    if data is None:
+        data = get_crash_data(uuid)
     return get_crash_info(
         data, uuid, buildid, channel, mindate, chgset, filelog, interesting_chgsets
     )
@@ -97,12 +201,11 @@ def inspect_stacktrace(data, build_node):
     res = []
     files = set()
     dump = data["json_dump"]
-    max_frames = 50
     if "threads" in dump:
         N = dump["crash_info"].get("crashing_thread")
         if N is not None:
             frames = dump["threads"][N]["frames"]
-            frames = frames[0:max_frames]
+            frames = frames[0:MAX_FRAMES]
             for n, frame in enumerate(frames):
                 uri = frame.get("file")
                 filename, node = get_path_node(uri)
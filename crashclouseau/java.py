@@ -5,9 +5,8 @@
 import html
 from libmozdata.hgmozilla import Mercurial
 import re
-import requests
 import time
-from . import models, tools
+from . import httpclient, models, tools
 
 
 # must match 'at android.os.Parcel.readException(Parcel.java:1552)'
@@ -113,7 +112,7 @@ def reformat_java_stacktrace(
 def get_sha(path, filename, sleep=0.1, retry=10):
     url = "{}/contents/{}".format(GITHUB_URL, path)
     for _ in range(retry):
-        r = requests.get(url)
+        r = httpclient.get(url)
         if r.status_code == 200:
             for data in r.json():
                 if data["name"] == filename:
@@ -127,7 +126,7 @@ def get_sha(path, filename, sleep=0.1, retry=10):
 def get_java_files(root, sha, sleep=0.1, retry=10):
     url = "{}/git/trees/{}?recursive=1".format(GITHUB_URL, sha)
     for _ in range(retry):
-        r = requests.get(url)
+        r = httpclient.get(url)
         if r.status_code == 200:
             res = []
             for data in r.json()["tree"]:
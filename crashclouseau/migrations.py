@@ -0,0 +1,246 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from . import db
+from .logger import logger
+from .models import BuildSummary, FilePush, SchemaMigration, Watermark
+
+
+def create_index(name, table, columns, where=None):
+    """Get a step creating an index without locking the table for writes"""
+    if where:
+        columns += ") WHERE (" + where
+
+    def step(conn):
+        # a failed CREATE INDEX CONCURRENTLY leaves an invalid index behind
+        valid = conn.execute(
+            db.text(
+                "SELECT i.indisvalid FROM pg_class c "
+                "JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :name"
+            ),
+            {"name": name},
+        ).scalar()
+        if valid is False:
+            conn.execute(db.text("DROP INDEX CONCURRENTLY IF EXISTS {}".format(name)))
+        conn.execute(
+            db.text(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})".format(
+                    name, table, columns
+                )
+            )
+        )
+
+    return step
+
+
+# The migrations are applied in order and each one only once.
+# A fresh database is created with the models (see models.create)
+# and is stamped with all the versions: so a migration must bring
+# an existing database to the state described by the models.
+MIGRATIONS = [
+    (
+        1,
+        "Indexes for the hot query paths",
+        [
+            create_index("ix_nodes_channel_node", "nodes", "channel, node"),
+            create_index("ix_nodes_channel_pushdate", "nodes", "channel, pushdate"),
+            create_index("ix_changesets_nodeid", "changesets", "nodeid"),
+            create_index("ix_changesets_fileid", "changesets", "fileid"),
+            create_index(
+                "ix_builds_product_channel_buildid",
+                "builds",
+                "product, channel, buildid",
+            ),
+            create_index("ix_uuids_analyzed", "uuids", "analyzed"),
+            create_index("ix_uuids_stackhash", "uuids", "stackhash"),
+            create_index("ix_uuids_jstackhash", "uuids", "jstackhash"),
+            create_index(
+                "ix_uuids_signature_proto_build",
+                "uuids",
+                "signatureid, protohash, buildid",
+            ),
+            create_index("ix_crashstack_uuidid", "crashstack", "uuidid"),
+            create_index("ix_scores_crashstackid", "scores", "crashstackid"),
+        ],
+    ),
+    (
+        2,
+        "Suffix index for File.get_full_path",
+        [
+            create_index(
+                "ix_files_reversed_name", "files", "reverse(name) text_pattern_ops"
+            ),
+        ],
+    ),
+    (
+        3,
+        "Per-file push table for Changeset.find",
+        [
+            lambda conn: FilePush.__table__.create(conn, checkfirst=True),
+            "INSERT INTO file_pushes (nodeid, fileid, channel, pushdate, node) "
+            "SELECT nodes.id, changesets.fileid, nodes.channel, nodes.pushdate, "
+            "nodes.node "
+            "FROM changesets JOIN nodes ON nodes.id = changesets.nodeid "
+            "WHERE nodes.merge IS false ON CONFLICT DO NOTHING",
+            "ANALYZE file_pushes",
+        ],
+    ),
+    (
+        4,
+        "Build summary for UUID.get_buildids",
+        [
+            lambda conn: BuildSummary.__table__.create(conn, checkfirst=True),
+            "INSERT INTO build_summary (buildid, useless) "
+            "SELECT DISTINCT buildid, useless FROM uuids "
+            "WHERE analyzed IS true AND buildid IS NOT NULL ON CONFLICT DO NOTHING",
+        ],
+    ),
+    (
+        5,
+        "Lease on the reports claimed by a worker",
+        ["ALTER TABLE uuids ADD COLUMN IF NOT EXISTS claimed timestamp with time zone"],
+    ),
+    (
+        6,
+        "Index on the non-analyzed changesets",
+        [
+            create_index(
+                "ix_changesets_not_analyzed",
+                "changesets",
+                "nodeid",
+                where="analyzed IS false",
+            ),
+        ],
+    ),
+    (
+        7,
+        "Watermarks for the incremental updates",
+        [lambda conn: Watermark.__table__.create(conn, checkfirst=True)],
+    ),
+    (
+        8,
+        "Lease and errors on the nodes claimed for the patches analysis",
+        [
+            "ALTER TABLE nodes ADD COLUMN IF NOT EXISTS claimed "
+            "timestamp with time zone",
+            "ALTER TABLE nodes ADD COLUMN IF NOT EXISTS errors "
+            "integer NOT NULL DEFAULT 0",
+        ],
+    ),
+]
+
+
+# The queries which must be backed by an index: (name, query, params)
+HOT_QUERIES = [
+    (
+        "File.get_full_path",
+        "SELECT name FROM files WHERE reverse(name) LIKE :pattern LIMIT 1",
+        {"pattern": "avaj.ppAokceG/okceg/allizom/gro/%"},
+    ),
+    (
+        "Changeset.find",
+        "SELECT node FROM file_pushes WHERE fileid = :fileid AND channel = :channel "
+        "AND pushdate BETWEEN :mindate AND :maxdate",
+        {
+            "fileid": 1,
+            "channel": "nightly",
+            "mindate": "2020-01-01",
+            "maxdate": "2020-01-08",
+        },
+    ),
+    (
+        "Node.get_id",
+        "SELECT id FROM nodes WHERE channel = :channel AND node = :node",
+        {"channel": "nightly", "node": "0123456789ab"},
+    ),
+    (
+        "Node.get_max_date",
+        "SELECT max(pushdate) FROM nodes WHERE channel = :channel",
+        {"channel": "nightly"},
+    ),
+    (
+        "Changeset.add_analyzis",
+        "SELECT id FROM changesets WHERE nodeid = :nodeid",
+        {"nodeid": 1},
+    ),
+    (
+        "Build.get_pushdate_before",
+        "SELECT id FROM builds WHERE product = :product AND channel = :channel "
+        "AND buildid < :buildid ORDER BY buildid DESC LIMIT 1",
+        {"product": "Firefox", "channel": "nightly", "buildid": "2020-01-01"},
+    ),
+    (
+        "UUID.to_analyze",
+        "SELECT id FROM uuids WHERE analyzed = false LIMIT 1",
+        {},
+    ),
+    (
+        "UUID.is_stackhash_existing",
+        "SELECT id FROM uuids WHERE stackhash = :hash",
+        {"hash": "0123456789abcdef"},
+    ),
+    (
+        "UUID.add_bulk",
+        "SELECT id FROM uuids WHERE signatureid = :sgnid AND protohash = :hash "
+        "AND buildid = :bid",
+        {"sgnid": 1, "hash": "0123456789abcdef", "bid": 1},
+    ),
+    (
+        "CrashStack.get_by_uuid",
+        "SELECT id FROM crashstack WHERE uuidid = :uuidid",
+        {"uuidid": 1},
+    ),
+    (
+        "CrashStack.get_by_uuid (scores)",
+        "SELECT id FROM scores WHERE crashstackid = :csid",
+        {"csid": 1},
+    ),
+]
+
+
+def get_pending():
+    """Get the migrations which haven't been applied yet"""
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    applied = SchemaMigration.get_versions()
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def migrate():
+    """Apply the pending migrations"""
+    for version, description, steps in get_pending():
+        logger.info("Apply migration {}: {}.".format(version, description))
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+        with db.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as conn:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(db.text(step))
+        SchemaMigration.add(version, description)
+        logger.info("Migration {}: finished.".format(version))
+
+
+def stamp():
+    """Mark all the migrations as applied (for a database created from the models)"""
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    for version, description, _ in MIGRATIONS:
+        SchemaMigration.add(version, description)
+
+
+def check_queries():
+    """Explain the hot queries and return the ones using a sequential scan"""
+    failures = []
+    with db.engine.connect() as conn:
+        with conn.begin():
+            # the planner would use a seq scan on small tables anyway:
+            # it must only be used when there is no suitable index
+            conn.execute(db.text("SET LOCAL enable_seqscan = off"))
+            for name, query, params in HOT_QUERIES:
+                plan = conn.execute(db.text("EXPLAIN " + query), params)
+                plan = "\n".join(r[0] for r in plan)
+                if "Seq Scan" in plan:
+                    failures.append((name, plan))
+    return failures
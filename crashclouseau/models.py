@@ -3,18 +3,64 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from collections import defaultdict, OrderedDict
-from datetime import datetime
+from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from libmozdata.hgmozilla import Mercurial
 import sqlalchemy.dialects.postgresql as pg
 from sqlalchemy import inspect, func
 import pytz
-from . import config, db, utils
+import time
+from . import cache, config, db, patch, utils
 from .logger import logger
 
 
 CHANNEL_TYPE = db.Enum(*config.get_channels(), name="CHANNEL_TYPE")
 PRODUCT_TYPE = db.Enum(*config.get_products(), name="PRODUCT_TYPE")
+# max number of rows in a multi-row insert
+BULK_SIZE = 1000
+__SIGNATURE_IDS = None
+
+
+def get_signature_ids_cache():
+    """Get the cache signature -> id"""
+    global __SIGNATURE_IDS
+    if __SIGNATURE_IDS is None:
+        size = config.get_signature_cache_size()
+        if config.use_redis_for_signature_cache():
+            from .worker import conn
+
+            __SIGNATURE_IDS = cache.RedisLRU(
+                size, conn, "clouseau:signature_ids", loads=int
+            )
+        else:
+            __SIGNATURE_IDS = cache.LRU(size)
+    return __SIGNATURE_IDS
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = "schema_migrations"
+
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(256))
+    applied = db.Column(
+        db.DateTime(timezone=True), nullable=False, server_default=db.func.now()
+    )
+
+    def __init__(self, version, description):
+        self.version = version
+        self.description = description
+
+    @staticmethod
+    def get_versions():
+        return set(v for v, in db.session.query(SchemaMigration.version))
+
+    @staticmethod
+    def add(version, description):
+        ins = pg.insert(SchemaMigration).values(
+            version=version, description=description
+        )
+        db.session.execute(ins.on_conflict_do_nothing())
+        db.session.commit()
 
 
 class LastDate(db.Model):
@@ -52,11 +98,49 @@ class LastDate(db.Model):
         return None, None
 
 
+class Watermark(db.Model):
+    """The last upstream data (push date, buildid, crash date) seen by a stage
+    of the update for a product/channel"""
+
+    __tablename__ = "watermarks"
+
+    product = db.Column(PRODUCT_TYPE, primary_key=True)
+    channel = db.Column(CHANNEL_TYPE, primary_key=True)
+    stage = db.Column(db.String(16), primary_key=True)
+    value = db.Column(db.DateTime(timezone=True))
+    updated = db.Column(
+        db.DateTime(timezone=True), nullable=False, server_default=db.func.now()
+    )
+
+    @staticmethod
+    def get(product, channel):
+        qs = db.session.query(Watermark.stage, Watermark.value).filter(
+            Watermark.product == product, Watermark.channel == channel
+        )
+        return {q.stage: q.value.astimezone(pytz.utc) for q in qs if q.value}
+
+    @staticmethod
+    def set(product, channel, stage, value):
+        ins = pg.insert(Watermark).values(
+            product=product, channel=channel, stage=stage, value=value
+        )
+        upd = ins.on_conflict_do_update(
+            index_elements=["product", "channel", "stage"],
+            set_=dict(value=ins.excluded.value, updated=db.func.now()),
+        )
+        db.session.execute(upd)
+        db.session.commit()
+
+
 class File(db.Model):
     __tablename__ = "files"
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(512), unique=True)
+    __table_args__ = (
+        # to find a file from the end of its path (see get_full_path)
+        db.Index("ix_files_reversed_name", db.text("reverse(name) text_pattern_ops")),
+    )
 
     def __init__(self, name):
         self.name = name
@@ -89,24 +173,37 @@ class File(db.Model):
         return id
 
     @staticmethod
-    def get_ids(names):
-        rs = db.session.query(File).filter(File.name.in_(names))
+    def get_ids(names, commit=True):
+        rs = db.session.query(File.id, File.name).filter(File.name.in_(names))
         ids = {f.name: f.id for f in rs}
         newnames = set(names) - set(ids.keys())
-        news = []
-        for n in newnames:
-            f = File(n)
-            news.append(f)
-            db.session.add(f)
-        db.session.commit()
-        for n in news:
-            ids[n.name] = n.id
+        if newnames:
+            ins = (
+                pg.insert(File)
+                .on_conflict_do_nothing(index_elements=["name"])
+                .returning(File.id, File.name)
+            )
+            rs = db.session.execute(ins, [dict(name=n) for n in newnames])
+            for f in rs:
+                ids[f.name] = f.id
+        if commit:
+            db.session.commit()
 
         return ids
 
     @staticmethod
     def get_full_path(name):
-        m = db.session.query(File.name).filter(File.name.like("%/" + name)).first()
+        # name LIKE '%/foo/Bar.java' is a full scan, so we use
+        # reverse(name) LIKE 'avaJ.raB/oof/%' which uses the index on reverse(name)
+        pattern = ("/" + name)[::-1]
+        for c in "\\%_":
+            pattern = pattern.replace(c, "\\" + c)
+        pattern += "%"
+        m = (
+            db.session.query(File.name)
+            .filter(func.reverse(File.name).like(pattern))
+            .first()
+        )
         if m:
             return m[0]
         return name
@@ -133,15 +230,23 @@ class Node(db.Model):
     merge = db.Column(db.Boolean)
     bug = db.Column(db.Integer)
     hgauthor = db.Column(db.Integer, db.ForeignKey("hgauthors.id", ondelete="CASCADE"))
+    # lease taken by the worker analyzing the patch (see Changeset.claim)
+    claimed = db.Column(db.DateTime(timezone=True), nullable=True)
+    # number of failed analyzes of the patch
+    errors = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    __table_args__ = (
+        db.Index("ix_nodes_channel_node", "channel", "node"),
+        db.Index("ix_nodes_channel_pushdate", "channel", "pushdate"),
+    )
 
-    def __init__(self, channel, info):
+    def __init__(self, channel, info, hgauthor):
         self.channel = channel
         self.node = info["node"]
         self.pushdate = info["date"]
         self.backedout = info["backedout"]
         self.merge = info["merge"]
         self.bug = info["bug"]
-        self.hgauthor = HGAuthor.get_id(info["author"])
+        self.hgauthor = hgauthor
 
     @staticmethod
     def get_min_date(channel):
@@ -216,6 +321,15 @@ class Changeset(db.Model):
     touched_lines = db.Column(pg.ARRAY(db.Integer), default=[])
     isnew = db.Column(db.Boolean, default=False)
     analyzed = db.Column(db.Boolean, default=False)
+    __table_args__ = (
+        db.Index("ix_changesets_nodeid", "nodeid"),
+        db.Index("ix_changesets_fileid", "fileid"),
+        db.Index(
+            "ix_changesets_not_analyzed",
+            "nodeid",
+            postgresql_where=db.text("analyzed IS false"),
+        ),
+    )
 
     def __init__(self, nodeid, fileid):
         self.nodeid = nodeid
@@ -223,8 +337,14 @@ class Changeset(db.Model):
 
     @staticmethod
     def reset(revs):
-        q = db.session.query(Changeset).join(Node)
-        q = q.filter(Node.node.in_(revs)).update(
+        # the patches will be retrieved and parsed again
+        patch.forget(revs)
+        db.session.query(Node).filter(Node.node.in_(revs)).update(
+            {"claimed": None, "errors": 0}, synchronize_session=False
+        )
+        nodeids = db.select(Node.id).where(Node.node.in_(revs))
+        q = db.session.query(Changeset)
+        q = q.filter(Changeset.nodeid.in_(nodeids)).update(
             {
                 "analyzed": False,
                 "isnew": False,
@@ -271,28 +391,111 @@ class Changeset(db.Model):
         res = [(nodeid, node) for _, nodeid, node in fls]
         return res
 
+    @staticmethod
+    def claim(n, lease, max_errors):
+        """Claim at most n nodes having non-analyzed changesets for lease seconds:
+        (nodeid, node, channel). The nodes claimed by another worker are skipped
+        and the ones which failed max_errors times are given up."""
+        expired = db.func.now() - timedelta(seconds=lease)
+        sel = db.select(Node.id).where(
+            Node.merge.is_(False),
+            Node.errors < max_errors,
+            db.or_(Node.claimed.is_(None), Node.claimed < expired),
+            db.exists().where(
+                Changeset.nodeid == Node.id, Changeset.analyzed.is_(False)
+            ),
+        )
+        # FOR NO KEY UPDATE: the inserts of rows referencing the nodes aren't blocked
+        sel = (
+            sel.order_by(Node.id)
+            .limit(n)
+            .with_for_update(skip_locked=True, key_share=True, of=Node)
+        )
+        upd = (
+            db.update(Node)
+            .where(Node.id.in_(sel))
+            .values(claimed=db.func.now())
+            .returning(Node.id, Node.node, Node.channel)
+        )
+        nodes = sorted(db.session.execute(upd).all())
+        # the patches are retrieved without holding the locks
+        db.session.commit()
+        return nodes
+
+    @staticmethod
+    def set_errors(nodeids, commit=True):
+        """Count a failed analyzis for the nodes: they're retried once the lease
+        has expired"""
+        if nodeids:
+            db.session.execute(
+                db.update(Node)
+                .where(Node.id.in_(list(nodeids)))
+                .values(errors=Node.errors + 1)
+            )
+        if commit:
+            db.session.commit()
+
     @staticmethod
     def add(chgsets, date, channel):
         if not chgsets:
             return None, None
 
-        nodes = []
+        start = time.time()
+        authors = HGAuthor.get_ids(
+            chgset["author"][0] for chgset in chgsets if chgset["author"]
+        )
+        rows = []
         files = set()
         for chgset in chgsets:
-            node = Node(channel, chgset)
-            db.session.add(node)
-            nodes.append((node, chgset))
+            author = chgset["author"]
+            rows.append(
+                dict(
+                    channel=channel,
+                    node=chgset["node"],
+                    pushdate=chgset["date"],
+                    backedout=chgset["backedout"],
+                    merge=chgset["merge"],
+                    bug=chgset["bug"],
+                    hgauthor=authors[author[0]] if author else 1,
+                )
+            )
             files |= set(chgset["files"])
-        db.session.commit()
 
+        ins = pg.insert(Node).returning(Node.id, Node.node)
+        nodeids = {r.node: r.id for r in db.session.execute(ins, rows)}
+
+        n_chgsets = 0
         if files:
-            ids = File.get_ids(files)
-            for node, chgset in nodes:
-                nodeid = node.id
-                for f in chgset["files"]:
-                    c = Changeset(nodeid, ids[f])
-                    db.session.add(c)
-            db.session.commit()
+            ids = File.get_ids(files, commit=False)
+            rows = [
+                dict(nodeid=nodeids[chgset["node"]], fileid=ids[f])
+                for chgset in chgsets
+                for f in chgset["files"]
+            ]
+            n_chgsets = len(rows)
+            if rows:
+                db.session.execute(pg.insert(Changeset), rows)
+            rows = [
+                dict(
+                    fileid=ids[f],
+                    nodeid=nodeids[chgset["node"]],
+                    channel=channel,
+                    pushdate=chgset["date"],
+                    node=chgset["node"],
+                )
+                for chgset in chgsets
+                if not chgset["merge"]
+                for f in chgset["files"]
+            ]
+            if rows:
+                db.session.execute(pg.insert(FilePush).on_conflict_do_nothing(), rows)
+        db.session.commit()
+
+        logger.info(
+            "Changeset.add for {}: {} nodes and {} changesets written in {:.3f}s".format(
+                channel, len(nodeids), n_chgsets, time.time() - start
+            )
+        )
 
         return Node.clean(date, channel)
 
@@ -330,57 +533,130 @@ class Changeset(db.Model):
         if commit:
             db.session.commit()
 
+    @staticmethod
+    def add_analyzis_bulk(data, commit=True):
+        """Set the analyzis for several nodes: data is nodeid => parsed patch"""
+        if not data:
+            if commit:
+                db.session.commit()
+            return
+
+        chgs = (
+            db.session.query(Changeset.id, Changeset.nodeid, File.name)
+            .select_from(Changeset)
+            .join(File)
+            .filter(Changeset.nodeid.in_(list(data.keys())))
+        )
+        rows = []
+        for chg in chgs:
+            # if the filename is not in data,
+            # then it means that the file has been deleted
+            info = (data[chg.nodeid] or {}).get(chg.name) or {}
+            rows.append(
+                dict(
+                    id=chg.id,
+                    analyzed=True,
+                    added_lines=info.get("added") or [],
+                    deleted_lines=info.get("deleted") or [],
+                    touched_lines=info.get("touched") or [],
+                    isnew=bool(info.get("new")),
+                )
+            )
+        if rows:
+            db.session.execute(db.update(Changeset), rows)
+        if commit:
+            db.session.commit()
+
     @staticmethod
     def find(filenames, mindate, maxdate, channel):
         if not filenames:
             return None
 
+        # file_pushes is an index-only scan for each file
         chgs = (
-            db.session.query(Changeset.id, File.name, Node.node)
-            .select_from(Changeset)
-            .join(Node)
+            db.session.query(File.name, FilePush.node)
+            .select_from(FilePush)
             .join(File)
         )
         chgs = chgs.filter(
             File.name.in_(filenames),
-            mindate <= Node.pushdate,
-            Node.pushdate <= maxdate,
-            Node.channel == channel,
-            Node.merge.is_(False),
+            FilePush.channel == channel,
+            mindate <= FilePush.pushdate,
+            FilePush.pushdate <= maxdate,
         )
         res = {}
-        for _, fname, node in chgs:
+        for fname, node in chgs:
             if fname not in res:
                 res[fname] = []
             res[fname].append(node)
         return res
 
     @staticmethod
-    def get_scores(filename, line, chgsets, csid):
-        chgs = db.session.query(Changeset).select_from(Changeset).join(Node).join(File)
+    def get_lines(filenames, chgsets):
+        """Get the analyzed lines for the changesets touching the files.
+        Return a dictionary: (filename, node) => [(changesetid, isnew, added, deleted, touched), ...]"""
+        res = defaultdict(list)
+        if not filenames or not chgsets:
+            return res
+
+        chgs = (
+            db.session.query(
+                Changeset.id,
+                File.name,
+                Node.node,
+                Changeset.isnew,
+                Changeset.added_lines,
+                Changeset.deleted_lines,
+                Changeset.touched_lines,
+            )
+            .select_from(Changeset)
+            .join(Node)
+            .join(File)
+        )
         chgs = chgs.filter(
-            Node.node.in_(chgsets), File.name == filename, Changeset.analyzed.is_(True)
+            Node.node.in_(list(chgsets)),
+            File.name.in_(list(filenames)),
+            Changeset.analyzed.is_(True),
         )
-        res = []
-        M = config.get_max_score()
         for chg in chgs:
-            if chg.isnew:
-                res.append((chg.id, csid, M))
-            else:
-                added = chg.added_lines
-                deleted = chg.deleted_lines
-                touched = chg.touched_lines
-                sc = max(
-                    utils.get_line_score(line, touched),
-                    utils.get_line_score(line, added),
+            res[(chg.name, chg.node)].append(
+                (
+                    chg.id,
+                    chg.isnew,
+                    chg.added_lines,
+                    chg.deleted_lines,
+                    chg.touched_lines,
                 )
-                if sc < 5:
-                    sc = max(sc, utils.get_line_score(line, deleted))
-                res.append((chg.id, csid, sc))
-
+            )
         return res
 
 
+class FilePush(db.Model):
+    """The non-merge pushes touching a file: a denormalized copy of
+    changesets x nodes used by Changeset.find"""
+
+    __tablename__ = "file_pushes"
+
+    nodeid = db.Column(
+        db.Integer, db.ForeignKey("nodes.id", ondelete="CASCADE"), primary_key=True
+    )
+    fileid = db.Column(
+        db.Integer, db.ForeignKey("files.id", ondelete="CASCADE"), primary_key=True
+    )
+    channel = db.Column(CHANNEL_TYPE)
+    pushdate = db.Column(db.DateTime(timezone=True))
+    node = db.Column(db.String(12))
+    __table_args__ = (
+        db.Index(
+            "ix_file_pushes_file_channel_pushdate",
+            "fileid",
+            "channel",
+            "pushdate",
+            postgresql_include=["node"],
+        ),
+    )
+
+
 class Build(db.Model):
     __tablename__ = "builds"
 
@@ -392,6 +668,7 @@ class Build(db.Model):
     nodeid = db.Column(db.Integer, db.ForeignKey("nodes.id", ondelete="CASCADE"))
     __table_args__ = (
         db.UniqueConstraint("buildid", "product", "channel", name="uix_builds"),
+        db.Index("ix_builds_product_channel_buildid", "product", "channel", "buildid"),
     )
 
     def __init__(self, buildid, product, channel, version, nodeid):
@@ -525,6 +802,19 @@ class Build(db.Model):
             return q[0]
         return None
 
+    @staticmethod
+    def get_ids(bids, channel, product):
+        res = {}
+        if bids:
+            qs = db.session.query(Build.id, Build.buildid).filter(
+                Build.buildid.in_(list(bids)),
+                Build.product == product,
+                Build.channel == channel,
+            )
+            for q in qs:
+                res[q.buildid] = q.id
+        return res
+
     @staticmethod
     def get_products(channel):
         prods = db.session.query(Build.product).filter(Build.channel == channel)
@@ -543,6 +833,41 @@ class Build(db.Model):
         return None
 
 
+class BuildSummary(db.Model):
+    """The builds having analyzed reports: maintained by UUID.set_analyzed
+    to avoid a DISTINCT on all the uuids in UUID.get_buildids"""
+
+    __tablename__ = "build_summary"
+
+    buildid = db.Column(
+        db.Integer, db.ForeignKey("builds.id", ondelete="CASCADE"), primary_key=True
+    )
+    useless = db.Column(db.Boolean, primary_key=True)
+
+    @staticmethod
+    def add(uuid, useless, commit=True):
+        sel = db.select(UUID.buildid, db.literal(useless)).where(UUID.uuid == uuid)
+        ins = pg.insert(BuildSummary).from_select(["buildid", "useless"], sel)
+        db.session.execute(ins.on_conflict_do_nothing())
+        if commit:
+            db.session.commit()
+
+    @staticmethod
+    def refresh(bids, commit=True):
+        """Remove the builds which have no more analyzed reports"""
+        if bids:
+            has_uuids = db.exists().where(
+                UUID.buildid == BuildSummary.buildid,
+                UUID.useless == BuildSummary.useless,
+                UUID.analyzed.is_(True),
+            )
+            db.session.query(BuildSummary).filter(
+                BuildSummary.buildid.in_(list(bids)), ~has_uuids
+            ).delete(synchronize_session=False)
+        if commit:
+            db.session.commit()
+
+
 class HGAuthor(db.Model):
     __tablename__ = "hgauthors"
 
@@ -565,42 +890,39 @@ class HGAuthor(db.Model):
         if not info:
             return 1
 
-        info = info[0]
-        email, real, nick = info
-        sel = db.select(db.literal(email), db.literal(real), db.literal(nick)).where(
-            ~db.exists().where(
-                db.and_(
-                    HGAuthor.email == email,
-                    HGAuthor.real == real,
-                    HGAuthor.nick == nick,
-                )
-            )
-        )
-        ins = (
-            db.insert(HGAuthor)
-            .from_select([HGAuthor.email, HGAuthor.real, HGAuthor.nick], sel)
-            .returning(HGAuthor.id)
-            .cte("inserted")
-        )
-        rs = (
-            db.session.query(HGAuthor.id)
-            .filter(
-                HGAuthor.email == email, HGAuthor.real == real, HGAuthor.nick == nick
-            )
-            .union_all(
-                db.session.query(HGAuthor.id)
-                .select_from(ins)
-                .filter(Signature.id == ins.c.id)
-            )
-        )
+        info = tuple(info[0])
+        return HGAuthor.get_ids([info])[info]
 
-        first = rs.first()
-        if first is None:
-            first = rs.first()
+    @staticmethod
+    def get_ids(infos):
+        """Get the ids for the triples (email, real, nick) (the missing ones are created)"""
+        infos = set(tuple(info) for info in infos)
+        if not infos:
+            return {}
 
-        id = first[0]
+        infos = list(infos)
+        res = {}
+        for chunk in utils.chunks(infos, BULK_SIZE):
+            ins = (
+                pg.insert(HGAuthor)
+                .values([dict(email=e, real=r, nick=n) for e, r, n in chunk])
+                .on_conflict_do_nothing(constraint="uix_hgauthors")
+                .returning(HGAuthor.id, HGAuthor.email, HGAuthor.real, HGAuthor.nick)
+                .cte("inserted")
+            )
+            rs = db.union_all(
+                db.select(
+                    HGAuthor.id, HGAuthor.email, HGAuthor.real, HGAuthor.nick
+                ).where(
+                    db.tuple_(HGAuthor.email, HGAuthor.real, HGAuthor.nick).in_(chunk)
+                ),
+                db.select(ins.c.id, ins.c.email, ins.c.real, ins.c.nick),
+            )
+            for r in db.session.execute(rs):
+                res[(r.email, r.real, r.nick)] = r.id
         db.session.commit()
-        return id
+
+        return res
 
     @staticmethod
     def put(data):
@@ -622,32 +944,45 @@ class Signature(db.Model):
 
     @staticmethod
     def get_id(signature):
-        sel = db.select(db.literal(signature)).where(
-            ~db.exists().where(Signature.signature == signature)
+        return Signature.get_ids([signature])[signature]
+
+    @staticmethod
+    def get_ids(signatures):
+        """Get the ids for the signatures (the missing ones are created)"""
+        ids_cache = get_signature_ids_cache()
+        signatures = set(signatures)
+        res = ids_cache.get_many(signatures)
+        signatures = [s for s in signatures if s not in res]
+        if not signatures:
+            return res
+
+        inp = db.select(
+            func.unnest(db.literal(signatures, pg.ARRAY(db.String))).label(
+                "signature"
+            )
+        ).cte("input")
+        sel = db.select(inp.c.signature).where(
+            ~db.exists().where(Signature.signature == inp.c.signature)
         )
         ins = (
             db.insert(Signature)
             .from_select([Signature.signature], sel)
-            .returning(Signature.id)
+            .returning(Signature.id, Signature.signature)
             .cte("inserted")
         )
-        rs = (
-            db.session.query(Signature.id)
-            .filter(Signature.signature == signature)
-            .union_all(
-                db.session.query(Signature.id)
-                .select_from(ins)
-                .filter(Signature.id == ins.c.id)
-            )
+        rs = db.union_all(
+            db.select(Signature.id, Signature.signature).join(
+                inp, Signature.signature == inp.c.signature
+            ),
+            db.select(ins.c.id, ins.c.signature),
         )
 
-        first = rs.first()
-        if first is None:
-            first = rs.first()
-
-        id = first[0]
+        ids = {r.signature: r.id for r in db.session.execute(rs)}
         db.session.commit()
-        return id
+        ids_cache.put_many(ids)
+        res.update(ids)
+
+        return res
 
     @staticmethod
     def get_reports(signatures, product=None, channel=None):
@@ -766,6 +1101,27 @@ class Stats(db.Model):
         if commit:
             db.session.commit()
 
+    @staticmethod
+    def add_bulk(rows):
+        """Upsert the rows (signatureid, buildid, number, installs)
+        and return the number of new ones"""
+        if not rows:
+            return 0
+
+        ins = pg.insert(Stats)
+        upd = ins.on_conflict_do_update(
+            index_elements=["signatureid", "buildid"],
+            set_=dict(number=ins.excluded.number, installs=ins.excluded.installs),
+        ).returning(db.literal_column("(xmax = 0)"))
+        rs = db.session.connection().execute(
+            upd,
+            [
+                dict(signatureid=s, buildid=b, number=n, installs=i)
+                for s, b, n, i in rows
+            ],
+        )
+        return sum(1 for r in rs if r[0])
+
 
 class UUID(db.Model):
     __tablename__ = "uuids"
@@ -786,6 +1142,14 @@ class UUID(db.Model):
     created = db.Column(
         db.DateTime(timezone=True), nullable=False, server_default=db.func.now()
     )
+    # lease taken by the worker analyzing the report (see UUID.claim)
+    claimed = db.Column(db.DateTime(timezone=True), nullable=True)
+    __table_args__ = (
+        db.Index("ix_uuids_analyzed", "analyzed"),
+        db.Index("ix_uuids_stackhash", "stackhash"),
+        db.Index("ix_uuids_jstackhash", "jstackhash"),
+        db.Index("ix_uuids_signature_proto_build", "signatureid", "protohash", "buildid"),
+    )
 
     def __init__(self, uuid, signatureid, protohash, buildid):
         self.uuid = uuid
@@ -820,13 +1184,25 @@ class UUID(db.Model):
 
     @staticmethod
     def reset(uuids):
-        qs = db.session.query(UUID.id).filter(UUID.uuid.in_(uuids))
-        qs.update(
-            {"analyzed": False, "useless": False, "stackhash": "", "jstackhash": ""},
-            synchronize_session="fetch",
+        upd = (
+            db.update(UUID)
+            .where(UUID.uuid.in_(uuids))
+            .values(
+                analyzed=False,
+                useless=False,
+                stackhash="",
+                jstackhash="",
+                error=False,
+                claimed=None,
+            )
+            .returning(UUID.id, UUID.buildid)
         )
-
-        res = [q.id for q in qs]
+        res = []
+        bids = set()
+        for q in db.session.execute(upd):
+            res.append(q.id)
+            bids.add(q.buildid)
+        BuildSummary.refresh(bids, commit=False)
         db.session.commit()
 
         return res
@@ -875,6 +1251,51 @@ class UUID(db.Model):
 
         return ret
 
+    @staticmethod
+    def add_bulk(rows):
+        """Same as add for a list of (uuid, signatureid, proto, buildid)
+        and return the number of new uuids"""
+        if not rows:
+            return 0
+
+        sgnids = set(r[1] for r in rows)
+        bidids = set(r[3] for r in rows)
+        qs = db.session.query(UUID.signatureid, UUID.protohash, UUID.buildid).filter(
+            UUID.signatureid.in_(list(sgnids)), UUID.buildid.in_(list(bidids))
+        )
+        existing = set(tuple(q) for q in qs)
+
+        # keep the same semantics as several calls to UUID.add:
+        # a triple (signature, proto, build) is added only once
+        # and the last one wins when a uuid appears several times
+        values = {}
+        for uuid, signatureid, proto, buildid in rows:
+            protohash = utils.hash(proto)
+            key = (signatureid, protohash, buildid)
+            if key not in existing:
+                existing.add(key)
+                values[uuid] = dict(
+                    uuid=uuid,
+                    signatureid=signatureid,
+                    protohash=protohash,
+                    buildid=buildid,
+                )
+
+        if not values:
+            return 0
+
+        ins = pg.insert(UUID)
+        upd = ins.on_conflict_do_update(
+            index_elements=["uuid"],
+            set_=dict(
+                signatureid=ins.excluded.signatureid,
+                protohash=ins.excluded.protohash,
+                buildid=ins.excluded.buildid,
+            ),
+        ).returning(db.literal_column("(xmax = 0)"))
+        rs = db.session.connection().execute(upd, list(values.values()))
+        return sum(1 for r in rs if r[0])
+
     @staticmethod
     def add_stack_hash(uuid, sh, jsh, commit=True):
         q = db.session.query(UUID).filter(UUID.uuid == uuid)
@@ -889,6 +1310,7 @@ class UUID(db.Model):
     def set_analyzed(uuid, useless, commit=True):
         q = db.session.query(UUID).filter(UUID.uuid == uuid)
         q.update({"useless": useless, "analyzed": True})
+        BuildSummary.add(uuid, useless, commit=False)
         if commit:
             db.session.commit()
 
@@ -908,6 +1330,47 @@ class UUID(db.Model):
             uuid = uuid.filter(UUID.analyzed.is_(False)).first()
         return uuid
 
+    @staticmethod
+    def claim(n, lease):
+        """Claim at most n non-analyzed reports for lease seconds.
+        The rows claimed by another worker are skipped."""
+        expired = db.func.now() - timedelta(seconds=lease)
+        sel = (
+            db.select(UUID.id)
+            .join(Build)
+            .join(Node)
+            .where(
+                UUID.analyzed.is_(False),
+                UUID.error.is_(False),
+                db.or_(UUID.claimed.is_(None), UUID.claimed < expired),
+            )
+            .order_by(UUID.id)
+            .limit(n)
+            .with_for_update(skip_locked=True, of=UUID)
+        )
+        upd = (
+            db.update(UUID)
+            .where(UUID.id.in_(sel))
+            .values(claimed=db.func.now())
+            .returning(UUID.id)
+        )
+        ids = [r.id for r in db.session.execute(upd)]
+        db.session.commit()
+        if not ids:
+            return []
+
+        uuids = (
+            db.session.query(
+                UUID.uuid, Build.buildid, Build.channel, Build.product, Node.node
+            )
+            .select_from(UUID)
+            .join(Build)
+            .join(Node)
+            .filter(UUID.id.in_(ids))
+            .order_by(UUID.id)
+        )
+        return uuids.all()
+
     @staticmethod
     def get_bid_chan(uuid):
         r = (
@@ -1118,16 +1581,12 @@ class UUID(db.Model):
     @staticmethod
     def get_buildids(no_score=False):
         bids = (
-            db.session.query(
-                UUID.id, Build.product, Build.channel, Build.buildid, Build.version
-            )
-            .select_from(UUID)
+            db.session.query(Build.product, Build.channel, Build.buildid, Build.version)
+            .select_from(BuildSummary)
             .join(Build)
         )
-        bids = (
-            bids.filter(UUID.useless.is_(no_score), UUID.analyzed.is_(True))
-            .distinct(Build.product, Build.channel, Build.buildid)
-            .order_by(Build.buildid.desc())
+        bids = bids.filter(BuildSummary.useless.is_(no_score)).order_by(
+            Build.buildid.desc()
         )
         res = {}
         for bid in bids:
@@ -1154,6 +1613,7 @@ class Score(db.Model):
         db.Integer, db.ForeignKey("crashstack.id", ondelete="CASCADE")
     )
     score = db.Column(db.Integer)
+    __table_args__ = (db.Index("ix_scores_crashstackid", "crashstackid"),)
 
     def __init__(self, changesetid, crashstackid, score):
         self.changesetid = changesetid
@@ -1161,10 +1621,17 @@ class Score(db.Model):
         self.score = score
 
     @staticmethod
-    def set(data):
-        for changesetid, crashstackid, score in data:
-            db.session.add(Score(changesetid, crashstackid, score))
-        db.session.commit()
+    def set(data, commit=True):
+        if data:
+            db.session.execute(
+                pg.insert(Score),
+                [
+                    dict(changesetid=c, crashstackid=cs, score=sc)
+                    for c, cs, sc in data
+                ],
+            )
+        if commit:
+            db.session.commit()
 
     @staticmethod
     def get_by_score(score):
@@ -1193,6 +1660,7 @@ class CrashStack(db.Model):
     line = db.Column(db.Integer)
     node = db.Column(db.String(12))
     internal = db.Column(db.Boolean)
+    __table_args__ = (db.Index("ix_crashstack_uuidid", "uuidid"),)
 
     def __init__(
         self,
@@ -1227,44 +1695,63 @@ class CrashStack(db.Model):
 
     @staticmethod
     def put_frames(uuid, frames, java, commit=True):
-        css = []
         uuidid = UUID.get_id(uuid)
-        for frame in frames["frames"]:
-            cs = CrashStack(
-                uuidid,
-                frame["stackpos"],
-                java,
-                frame["original"],
-                frame["module"],
-                frame["filename"],
-                frame["function"],
-                frame["line"],
-                frame["node"],
-                frame["internal"],
+        frames = frames["frames"]
+        rows = [
+            dict(
+                uuidid=uuidid,
+                stackpos=frame["stackpos"],
+                java=java,
+                original=frame["original"],
+                module=frame["module"],
+                filename=frame["filename"],
+                function=frame["function"],
+                line=frame["line"],
+                node=frame["node"],
+                internal=frame["internal"],
             )
-            db.session.add(cs)
-            css.append((cs, frame))
+            for frame in frames
+        ]
+        csids = {}
+        if rows:
+            ins = pg.insert(CrashStack).returning(CrashStack.id, CrashStack.stackpos)
+            csids = {r.stackpos: r.id for r in db.session.execute(ins, rows)}
+
+        # get the lines for all the (file, changesets) in the stack in one query
+        filenames = set()
+        chgsets = set()
+        for frame in frames:
+            if frame["changesets"]:
+                filenames.add(frame["filename"])
+                chgsets |= set(frame["changesets"])
+        lines = Changeset.get_lines(filenames, chgsets)
 
-        db.session.commit()
+        scores = []
         max_score = 0
-        for cs, frame in css:
+        for frame in frames:
             csets = frame["changesets"]
-            if csets:
-                scores = Changeset.get_scores(
-                    frame["filename"], frame["line"], csets, cs.id
-                )
-                if scores:
-                    Score.set(scores)
-                    scores = max(s for _, _, s in scores)
-                    max_score = max(max_score, scores)
-                else:
-                    logger.warning(
-                        "No scores for {} at line {} and changesets {} (uuid {})".format(
-                            frame["filename"], frame["line"], csets, uuid
-                        )
+            if not csets:
+                continue
+            csid = csids[frame["stackpos"]]
+            filename = frame["filename"]
+            line = frame["line"]
+            n = len(scores)
+            for node in set(csets):
+                for chgid, isnew, added, deleted, touched in lines.get(
+                    (filename, node), []
+                ):
+                    sc = utils.get_changeset_score(line, isnew, added, deleted, touched)
+                    scores.append((chgid, csid, sc))
+                    max_score = max(max_score, sc)
+            if n == len(scores):
+                logger.warning(
+                    "No scores for {} at line {} and changesets {} (uuid {})".format(
+                        filename, line, csets, uuid
                     )
+                )
 
-        UUID.set_max_score(uuidid, max_score)
+        Score.set(scores, commit=False)
+        UUID.set_max_score(uuidid, max_score, commit=commit)
 
     @staticmethod
     def get_by_uuid(uuid):
@@ -1334,11 +1821,46 @@ def commit():
     db.session.commit()
 
 
+def put_crashes(data, channel, product):
+    """Put the data got from datacollector.get_new_signatures in the database.
+    Return the number of new stats, the number of new uuids
+    and the buildids which are not in the database"""
+    bids = set(bid for i in data.values() for bid in i["protos"].keys())
+    bidids = Build.get_ids(bids, channel, product)
+    errors = bids - set(bidids.keys())
+
+    sgns = [
+        sgn for sgn, i in data.items() if any(bid in bidids for bid in i["protos"])
+    ]
+    sgnids = Signature.get_ids(sgns)
+
+    stats = []
+    uuids = []
+    for sgn, i in data.items():
+        for bid, protos in i["protos"].items():
+            bidid = bidids.get(bid)
+            if bidid is None:
+                continue
+            sgnid = sgnids[sgn]
+            stats.append((sgnid, bidid, i["bids"][bid], i["installs"][bid]))
+            for proto in protos:
+                uuids.append((proto["uuid"], sgnid, proto["proto"], bidid))
+
+    new_stats = Stats.add_bulk(stats)
+    new_uuids = UUID.add_bulk(uuids)
+    db.session.commit()
+
+    return new_stats, new_uuids, errors
+
+
 def create():
     engine = db.engine
     if not inspect(engine).has_table("lastdate"):
+        from . import migrations
+
         db.create_all()
         db.session.commit()
+        migrations.stamp()
         return True
     return False
 
@@ -1346,3 +1868,4 @@ def create():
 def clear():
     db.drop_all()
     db.session.commit()
+    get_signature_ids_cache().clear()
@@ -2,19 +2,44 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from libmozdata.hgmozilla import RawRevision
-from parsepatch.patch import Patch
 from .logger import logger
-from . import utils
+from . import cache, config, hgbackend
+
+
+__CACHE = None
+
+
+def get_cache():
+    """Get the on-disk cache node => parsed patch (None if disabled)"""
+    global __CACHE
+    if __CACHE is None:
+        path = config.get_patch_cache_path()
+        if path:
+            __CACHE = cache.DiskCache(path, config.get_patch_cache_max_size())
+    return __CACHE
+
+
+def forget(chgsets):
+    """Remove the parsed patches of the revisions from the cache"""
+    c = get_cache()
+    if c is not None:
+        for chgset in chgsets:
+            c.delete(chgset)
 
 
 def parse(chgset, channel="nightly", chunk_size=1000000):
-    url = RawRevision.get_url(channel)
+    # a revision has the same hash on all the channels
+    c = get_cache()
+    if c is not None:
+        res = c.get(chgset)
+        if res is not None:
+            return res
+
     logger.info("Get patch for revision {}".format(chgset))
     try:
-        res = Patch.parse_changeset(
-            url, chgset, file_filter=utils.is_interesting_file, skip_comments=True
-        )
+        res = hgbackend.get_backend().parse_patch(chgset, channel)
+        if c is not None:
+            c.put(chgset, res)
         return res
     except Exception as e:
         msg = "Error in parsing patch with revision {}"
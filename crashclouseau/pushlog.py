@@ -2,12 +2,10 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from dateutil.relativedelta import relativedelta
 from libmozdata.hgmozilla import Mercurial, Revision
 from libmozdata import utils as lmdutils
 import re
-import requests
-from . import buildhub, hgauthors, models, utils
+from . import buildhub, hgauthors, hgbackend, models, utils
 
 
 BACKOUT_PAT = re.compile(
@@ -56,20 +54,9 @@ def collect(data, file_filter):
 def pushlog(
     startdate, enddate, channel="nightly", file_filter=utils.is_interesting_file
 ):
-    """Get the pushlog from hg.mozilla.org"""
-    # Get the pushes where startdate <= pushdate <= enddate
-    # pushlog uses strict inequality, it's why we add +/- 1 second
-    fmt = "%Y-%m-%d %H:%M:%S"
-    startdate -= relativedelta(seconds=1)
-    startdate = startdate.strftime(fmt)
-    enddate += relativedelta(seconds=1)
-    enddate = enddate.strftime(fmt)
-    url = "{}/json-pushes".format(Mercurial.get_repo_url(channel))
-    r = requests.get(
-        url,
-        params={"startdate": startdate, "enddate": enddate, "version": 2, "full": 1},
-    )
-    return collect(r.json(), file_filter)
+    """Get the pushlog where startdate <= pushdate <= enddate"""
+    data = hgbackend.get_backend().get_pushes_by_date(startdate, enddate, channel)
+    return collect(data, file_filter)
 
 
 def pushlog_for_revs(
@@ -77,12 +64,8 @@ def pushlog_for_revs(
 ):
     """Get the pushlog from startrev to endrev"""
     # startrev is not include in the pushlog
-    url = "{}/json-pushes".format(Mercurial.get_repo_url(channel))
-    r = requests.get(
-        url,
-        params={"fromchange": startrev, "tochange": endrev, "version": 2, "full": 1},
-    )
-    return collect(r.json(), file_filter)
+    data = hgbackend.get_backend().get_pushes_by_revs(startrev, endrev, channel)
+    return collect(data, file_filter)
 
 
 def pushlog_for_revs_url(startrev, endrev, channel):
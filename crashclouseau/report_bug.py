@@ -7,9 +7,8 @@ import functools
 from jinja2 import Environment, FileSystemLoader
 import libmozdata.config
 from libmozdata.hgmozilla import Mercurial
-import requests
 from urllib.parse import parse_qs, urlencode, urlparse
-from . import buginfo, models, utils
+from . import buginfo, httpclient, models, supersearch, utils
 
 
 def findall(p, s):
@@ -112,7 +111,6 @@ async def get_info_helper(uuid, changeset):
     bz = "https://bugzilla.mozilla.org/rest/bug"
     bzh = {"X-Bugzilla-API-Key": libmozdata.config.get("Bugzilla", "token", "")}
     bzq = {"id": bugid, "include_fields": ["product", "component", "assigned_to"]}
-    cs_api = "https://crash-stats.mozilla.org/api/SuperSearch/"
     cs_api_q = {
         "signature": "=" + info["signature"],
         "build_id": ">=" + info["buildid"],
@@ -125,20 +123,20 @@ async def get_info_helper(uuid, changeset):
     }
 
     loop = asyncio.get_event_loop()
-    f1 = loop.run_in_executor(None, functools.partial(requests.get, cs))
+    f1 = loop.run_in_executor(None, functools.partial(httpclient.get, cs))
     if bugid:
         f2 = loop.run_in_executor(
-            None, functools.partial(requests.get, bz, headers=bzh, params=bzq)
+            None, functools.partial(httpclient.get, bz, headers=bzh, params=bzq)
         )
     f3 = loop.run_in_executor(
-        None, functools.partial(requests.get, cs_api, params=cs_api_q)
+        None, functools.partial(supersearch.get, cs_api_q, kind="report")
     )
     r1 = await f1
     if bugid:
         r2 = await f2
     r3 = await f3
     bzquery = get_bz_query(r1.text)
-    first, stats = get_stats(r3.json(), int(info["buildid"]))
+    first, stats = get_stats(r3, int(info["buildid"]))
     bzdata = r2.json() if bugid else {}
     ni = improve(bzquery, bzdata, bugid)
     url = finalize_comment(bzquery, first, stats, info, changeset, bugid)
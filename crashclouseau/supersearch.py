@@ -0,0 +1,125 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import functools
+import hashlib
+import json
+from libmozdata import socorro
+from libmozdata.connection import Query
+from . import cache, config
+
+
+__CACHE = None
+
+
+class Done(object):
+    """Returned by search when all the results were in the cache"""
+
+    def wait(self):
+        return self
+
+
+def get_cache():
+    """Get the cache for the SuperSearch results"""
+    global __CACHE
+    if __CACHE is None:
+        if config.use_redis_for_supersearch_cache():
+            from .worker import conn
+
+            __CACHE = cache.RedisTTLCache(conn, "clouseau:supersearch")
+        else:
+            __CACHE = cache.TTLCache(config.get_supersearch_cache_size())
+    return __CACHE
+
+
+def get_key(url, params):
+    """Get the cache key for a query: the key doesn't depend on the order
+    of the parameters or of their values (except for _sort)"""
+    canonical = {}
+    for name, value in params.items():
+        if isinstance(value, (list, tuple)):
+            value = [str(v) for v in value]
+            if name != "_sort":
+                value = sorted(value)
+            if len(value) == 1:
+                value = value[0]
+        elif value is not None:
+            value = str(value)
+        if value is not None and value != []:
+            canonical[name] = value
+    key = json.dumps([url, canonical], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def call_handler(query, data):
+    if query.handlerdata is not None:
+        query.handler(data, query.handlerdata)
+    else:
+        query.handler(data)
+
+
+def put_and_call(query, key, kind, data, *args):
+    # the results with errors are not cached
+    if isinstance(data, dict) and not data.get("errors"):
+        ttl = config.get_supersearch_cache_ttl(kind)
+        if ttl > 0:
+            get_cache().put(key, json.dumps(data, separators=(",", ":")), ttl)
+    call_handler(query, data)
+
+
+def search(params=None, handler=None, handlerdata=None, queries=None, kind="default"):
+    """Same as socorro.SuperSearch but the results are cached (the time to live
+    depends on the kind of the queries): the handlers of the queries in the cache
+    are called in the current thread and the other queries are sent"""
+    if queries is None:
+        queries = [Query(socorro.SuperSearch.URL, params, handler, handlerdata)]
+    elif isinstance(queries, Query):
+        queries = [queries]
+
+    c = get_cache()
+    hits = []
+    misses = []
+    for query in queries:
+        key = get_key(query.url, query.params)
+        data = c.get(key)
+        if data is None:
+            c.incr(kind + ":misses")
+            misses.append(
+                Query(
+                    query.url,
+                    params=query.params,
+                    handler=functools.partial(put_and_call, query, key, kind),
+                    handlerdata=query.handlerdata,
+                )
+            )
+        else:
+            c.incr(kind + ":hits")
+            hits.append((query, data))
+
+    res = socorro.SuperSearch(queries=misses) if misses else Done()
+    for query, data in hits:
+        call_handler(query, json.loads(data))
+
+    return res
+
+
+def get(params, kind="default"):
+    """Get the results of a SuperSearch query"""
+    data = []
+    search(
+        params=params,
+        handler=lambda x, data: data.append(x),
+        handlerdata=data,
+        kind=kind,
+    ).wait()
+    return data[0] if data else None
+
+
+def get_stats():
+    """Get the number of hits and misses by kind of queries"""
+    stats = {}
+    for name, n in get_cache().get_stats().items():
+        kind, what = name.rsplit(":", 1)
+        stats.setdefault(kind, {"hits": 0, "misses": 0})[what] = n
+    return stats
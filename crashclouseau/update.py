@@ -2,6 +2,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 from libmozdata import utils as lmdutils
@@ -9,7 +10,11 @@ import pytz
 from .logger import logger
 from .pushlog import pushlog
 from . import datacollector as dc
-from . import buildhub, config, inspector, models, utils, worker, patch
+from . import buildhub, config, db, hgbackend, inspector, models, utils, worker, patch
+
+
+# the stages of an update in the order where they run
+STAGES = ["pushlog", "builds", "crashes"]
 
 
 def put_build(buildid, product, channel, version, node=None):
@@ -21,6 +26,14 @@ def put_build(buildid, product, channel, version, node=None):
     models.Build.put_build(buildid, nodeid, product, channel, version)
 
 
+def refresh(channels):
+    """Pull the new pushes in the clones: it's done once per run, before
+    checking what moved, and the jobs read the clones as they are"""
+    backend = hgbackend.get_backend()
+    for channel in channels:
+        backend.refresh(channel)
+
+
 def put_filelog(channel, start_date=None, end_date=None):
     """Get and put the filelog in the database"""
     if not end_date:
@@ -41,7 +54,7 @@ def put_filelog(channel, start_date=None, end_date=None):
     return end_date
 
 
-def put_report(uuid, buildid, channel, product, chgset):
+def put_report(uuid, buildid, channel, product, chgset, data=None):
     """Put a report in the database"""
     if channel == "nightly":
         mindate = buildid - relativedelta(days=config.get_ndays())
@@ -58,6 +71,7 @@ def put_report(uuid, buildid, channel, product, chgset):
         chgset,
         models.Changeset.find,
         interesting_chgsets,
+        data=data,
     )
     if res is None:
         # 'json_dump' is not in crash data
@@ -66,8 +80,8 @@ def put_report(uuid, buildid, channel, product, chgset):
     useless = True
     chgsets = models.Changeset.to_analyze(chgsets=interesting_chgsets, channel=channel)
     for nodeid, node in chgsets:
-        data = patch.parse(node, channel=channel)
-        models.Changeset.add_analyzis(data, nodeid, channel)
+        analyzis = patch.parse(node, channel=channel)
+        models.Changeset.add_analyzis(analyzis, nodeid, channel)
 
     frames = res.get("nonjava")
     sh = jsh = ""
@@ -88,97 +102,181 @@ def put_report(uuid, buildid, channel, product, chgset):
     models.UUID.set_analyzed(uuid, useless)
 
 
-def analyze_one_report(uuid=None):
-    """Get a non-analyzed UUID in the database and analyze it"""
-    a = models.UUID.to_analyze(uuid)
-    if a:
-        try:
-            put_report(*a)
-        except Exception as e:
-            logger.error(e, exc_info=True)
-            models.UUID.set_error(a[0])
-        analyze_reports()
-    else:
-        analyze_patches()
+def analyze_report_batch():
+    """Claim batches of non-analyzed reports and analyze them until there is none"""
+    size = config.get_report_batch_size()
+    lease = config.get_report_lease()
+    while True:
+        reports = models.UUID.claim(size, lease)
+        if not reports:
+            break
+        # the missing crashes will be retrieved in put_report
+        crashes = inspector.get_crashes_data([r.uuid for r in reports])
+        for report in reports:
+            try:
+                put_report(*report, data=crashes.get(report.uuid))
+            except Exception as e:
+                logger.error(e, exc_info=True)
+                # the session is unusable until the failed transaction is rolled back
+                db.session.rollback()
+                models.UUID.set_error(report[0])
+    analyze_patches()
 
 
 def analyze_reports():
     """Analyze all the non-analyzed reports available in the database"""
-    queue = worker.get_queue()
-    if len(queue) <= 1:
-        queue.enqueue_call(func=analyze_one_report, result_ttl=0)
-
-
-def analyze_one_patch():
-    """Get a non-analyzed patch in the database and analyze it"""
-    nodeid, node, channel = models.Changeset.to_analyze()
-    if node:
-        try:
-            data = patch.parse(node, channel=channel)
-            models.Changeset.add_analyzis(data, nodeid, channel)
-        except Exception as e:
-            logger.error(e, exc_info=True)
-        analyze_patches()
+    # each job claims its own reports so they can run concurrently
+    for i in range(config.get_report_workers()):
+        job_id = worker.get_job_id(analyze_report_batch, i)
+        worker.enqueue_once(analyze_report_batch, job_id=job_id)
+
+
+def analyze_patch_batch():
+    """Claim batches of non-analyzed patches and get/parse them in a thread pool"""
+    size = config.get_patch_batch_size()
+    lease = config.get_patch_lease()
+    max_errors = config.get_patch_max_errors()
+    with ThreadPoolExecutor(max_workers=config.get_patch_workers()) as executor:
+        while True:
+            nodes = models.Changeset.claim(size, lease, max_errors)
+            if not nodes:
+                break
+            futures = {
+                executor.submit(patch.parse, node, channel=channel): nodeid
+                for nodeid, node, channel in nodes
+            }
+            data = {}
+            failed = []
+            for future in as_completed(futures):
+                nodeid = futures[future]
+                try:
+                    data[nodeid] = future.result()
+                except Exception as e:
+                    logger.error(e, exc_info=True)
+                    failed.append(nodeid)
+            models.Changeset.add_analyzis_bulk(data, commit=False)
+            # the failed nodes are retried by a later job once the lease has expired
+            models.Changeset.set_errors(failed)
 
 
 def analyze_patches():
     """Analyze all the non-analyzed patches available in the database"""
-    queue = worker.get_queue()
-    if len(queue) <= 1:
-        queue.enqueue_call(func=analyze_one_patch, result_ttl=0)
+    worker.enqueue_once(analyze_patch_batch)
+
+
+def get_builds_date(channel):
+    """Get the date of the first build to update for a channel"""
+    _, date = models.LastDate.get(channel)
+    return date - relativedelta(days=config.get_ndays())
 
 
 def update_builds(date, channel, product):
     """Update the builds"""
     logger.info("Update builds for {}/{}: started.".format(channel, product))
     if not date:
-        _, date = models.LastDate.get(channel)
-        date -= relativedelta(days=config.get_ndays())
+        date = get_builds_date(channel)
     data = buildhub.get(date, channel, prods=product)
     if data:
         models.Build.put_data(data)
     logger.info("Update builds: finished.")
 
 
+def update_all_builds(date, pairs):
+    """Update the builds for all the (channel, product) pairs:
+    the Buildhub queries are run concurrently"""
+    logger.info("Update builds for {}: started.".format(pairs))
+    queries = [
+        buildhub.get_query(date or get_builds_date(channel), channel, prods=product)
+        for channel, product in pairs
+    ]
+    for data in buildhub.get_many(queries):
+        if data:
+            models.Build.put_data(data)
+    logger.info("Update builds: finished.")
+
+
 def put_crashes(date, channel, product):
     """Get and put crashes data in the database"""
     if not date:
         date = pytz.utc.localize(datetime.utcnow())
     data = dc.get_new_signatures(product, channel, date)
 
-    errors = set()
-    for sgn, i in data.items():
-        sgnid = None
-        for bid, protos in i["protos"].items():
-            bidid = models.Build.get_id(bid, channel, product)
-            if bidid is None:
-                errors.add(bid)
-                continue
-            if sgnid is None:
-                sgnid = models.Signature.get_id(sgn)
-            models.Stats.add(sgnid, bidid, i["bids"][bid], i["installs"][bid])
-            for proto in protos:
-                uuid = proto["uuid"]
-                proto_sgn = proto["proto"]
-                models.UUID.add(uuid, sgnid, proto_sgn, bidid, commit=False)
-        models.commit()
+    stats, uuids, errors = models.put_crashes(data, channel, product)
+    logger.info(
+        "Put crashes for {}/{}: {} new stats and {} new uuids.".format(
+            product, channel, stats, uuids
+        )
+    )
 
     for bid in errors:
         logger.info("No buildid in db for {}/{}/{}".format(bid, product, channel))
 
 
-def update(date, channel, product, analyze=True):
+def get_stages(product, channel):
+    """Get the stages of the update whose upstream data moved since their last run.
+    Return the stages and the upstream marks to record once they're done."""
+    try:
+        marks = {
+            "pushlog": hgbackend.get_backend().get_last_pushdate(channel),
+            "builds": buildhub.get_last_buildid(channel, product),
+            "crashes": dc.get_last_crash_date(product, channel),
+        }
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        logger.info(
+            "Cannot get the marks for {}/{}: update all.".format(product, channel)
+        )
+        return list(STAGES), {}
+
+    last = models.Watermark.get(product, channel)
+    moved = {
+        stage: mark is None or stage not in last or mark > last[stage]
+        for stage, mark in marks.items()
+    }
+    # new pushes can make the builds without node usable and
+    # the crashes are collected for the builds in the database
+    reasons = {
+        "pushlog": [],
+        "builds": ["pushlog"],
+        "crashes": ["builds"],
+    }
+    stages = []
+    for stage in STAGES:
+        if moved[stage] or any(s in stages for s in reasons[stage]):
+            stages.append(stage)
+        else:
+            logger.info(
+                "Update {}/{}: skip {} (nothing new since {}).".format(
+                    product, channel, stage, last[stage]
+                )
+            )
+    return stages, marks
+
+
+def update(date, channel, product, analyze=True, stages=STAGES, marks=None):
     """Update all the data for a given date/channel/product"""
     logger.info("Update data: started.")
-    put_filelog(channel)
+    marks = marks or {}
+
+    def done(stage):
+        if marks.get(stage):
+            models.Watermark.set(product, channel, stage, marks[stage])
+
+    if "pushlog" in stages:
+        put_filelog(channel)
+        done("pushlog")
     if date:
         date = lmdutils.get_date_ymd(date)
-    update_builds(date, channel, product)
+    if "builds" in stages:
+        update_builds(date, channel, product)
+        done("builds")
 
-    try:
-        put_crashes(date, channel, product)
-    except Exception as e:
-        logger.error(e, exc_info=True)
+    if "crashes" in stages:
+        try:
+            put_crashes(date, channel, product)
+            done("crashes")
+        except Exception as e:
+            logger.error(e, exc_info=True)
 
     if analyze:
         analyze_reports()
@@ -186,16 +284,67 @@ def update(date, channel, product, analyze=True):
     logger.info("Update data: finished.")
 
 
-def update_in_queue(channel, product, date=None):
-    """Update in the queue"""
-    queue = worker.get_queue()
-    queue.enqueue_call(func=update, args=(date, channel, product), result_ttl=0)
+def update_in_queue(channel, product, date=None, stages=STAGES, marks=None):
+    """Update in the queue (unless an update is already pending)"""
+    worker.enqueue_once(
+        update,
+        args=(date, channel, product),
+        kwargs={"stages": stages, "marks": marks or {}},
+        job_id=worker.get_job_id(update, product, channel),
+    )
+
+
+def update_upstream(todo):
+    """Update the pushlog of the channels and the builds of the products/channels
+    in todo [(product, channel, stages, marks), ...]: the pushlog is put once
+    by channel and the builds are retrieved in one batch. Then the crashes
+    are updated in a job by product/channel."""
+    logger.info("Update upstream data: started.")
+    channels = {channel for _, channel, stages, _ in todo if "pushlog" in stages}
+    failed = set()
+    for channel in sorted(channels):
+        try:
+            put_filelog(channel)
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            failed.add(channel)
+    todo = [t for t in todo if t[1] not in failed]
+
+    def done(stage):
+        for product, channel, stages, marks in todo:
+            if stage in stages and marks.get(stage):
+                models.Watermark.set(product, channel, stage, marks[stage])
+
+    done("pushlog")
+    pairs = [(c, p) for p, c, stages, _ in todo if "builds" in stages]
+    if pairs:
+        update_all_builds(None, pairs)
+        done("builds")
+
+    for product, channel, stages, marks in todo:
+        if "crashes" in stages:
+            update_in_queue(channel, product, stages=["crashes"], marks=marks)
+    logger.info("Update upstream data: finished.")
 
 
 def update_all(
     products=config.get_products(), channels=config.get_channels(), date=None
 ):
-    """Update all"""
+    """Update all the product/channel whose upstream data moved"""
+    refresh(channels)
+    todo = []
     for product in products:
         for channel in channels:
-            update_in_queue(channel, product)
+            stages, marks = get_stages(product, channel)
+            if stages:
+                todo.append((product, channel, stages, marks))
+            else:
+                logger.info("Update {}/{}: nothing to do.".format(product, channel))
+    if todo:
+        # the jobs of the crashes are enqueued once the builds are in the database
+        worker.enqueue_once(
+            update_upstream, args=(todo,), job_id=worker.get_job_id(update_upstream)
+        )
+    # the reports whose lease expired must be analyzed even if nothing moved
+    # (the jobs aren't enqueued twice if they're already pending)
+    analyze_reports()
@@ -2,11 +2,13 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from array import array
 from bisect import bisect_left
 from collections import defaultdict
 from datetime import datetime
 import hashlib
 from libmozdata import socorro
+import numpy as np
 import pytz
 import six
 from . import config
@@ -75,6 +77,16 @@ def get_line_score(line, lines):
     return score(line, lines[i - 1])
 
 
+def get_changeset_score(line, isnew, added, deleted, touched):
+    """Get the score for a line in the lines touched by a changeset"""
+    if isnew:
+        return config.get_max_score()
+    sc = max(get_line_score(line, touched), get_line_score(line, added))
+    if sc < 5:
+        sc = max(sc, get_line_score(line, deleted))
+    return sc
+
+
 def get_file_url(repo_url, filename, node, line, original):
     """Get url for a file appearing in a stack trace"""
     if filename and node:
@@ -174,6 +186,116 @@ def get_new_crashing_bids(numbers, ndays, threshold):
     return res, big
 
 
+class CrashNumbers(object):
+    """The crash numbers and the installs by signature for a fixed set of builds.
+    The builds are sorted and grouped by day: each signature only has a row
+    with the counts and the installs indexed by the build position."""
+
+    def __init__(self, bids):
+        self.bids = sorted(set(get_build_date(bid) for bid in bids))
+        self.index = {bid: i for i, bid in enumerate(self.bids)}
+        # the bids as returned by Socorro (string or int) => position
+        self.positions = {}
+        # [[day, first position, last position + 1], ...]
+        self.days = []
+        for i, bid in enumerate(self.bids):
+            day = datetime(bid.year, bid.month, bid.day)
+            if self.days and self.days[-1][0] == day:
+                self.days[-1][2] = i + 1
+            else:
+                self.days.append([day, i, i + 1])
+        # the counts are in row[:N] and the installs in row[N:]
+        self.zeros = array("q", [0]) * (2 * len(self.bids))
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def get_position(self, bid):
+        pos = self.positions.get(bid)
+        if pos is None:
+            pos = self.positions[bid] = self.index[get_build_date(bid)]
+        return pos
+
+    def add(self, sgn, bid, count, installs):
+        """Set the number of crashes and installs for a signature in a build"""
+        row = self.rows.get(sgn)
+        if row is None:
+            row = self.rows[sgn] = self.zeros[:]
+        pos = self.get_position(bid)
+        row[pos] = count
+        row[pos + len(self.bids)] = installs
+
+    def get_new_crashing_bids(self, ndays, threshold):
+        """Same as get_new_crashing_bids for all the signatures at once:
+        return a dictionary signature => (new crashing bids, big)"""
+        if not self.rows:
+            return {}
+        sgns = list(self.rows.keys())
+        N = len(self.bids)
+        D = len(self.days)
+        rows = b"".join(self.rows[sgn] for sgn in sgns)
+        rows = np.frombuffer(rows, dtype=np.int64).reshape(len(sgns), 2 * N)
+        counts, installs = rows[:, :N], rows[:, N:]
+
+        # the numbers by day: a spike is a non-null day after ndays without crash
+        starts = np.array([start for _, start, _ in self.days])
+        numbers = np.add.reduceat(counts, starts, axis=1)
+        crashing = numbers != 0
+        # before[:, i] is the number of crashing days before the day i
+        before = np.cumsum(crashing, axis=1)
+        before = np.concatenate([np.zeros_like(before[:, :1]), before], axis=1)
+        spikes = np.zeros_like(crashing)
+        if ndays < D:
+            spikes[:, ndays:] = crashing[:, ndays:] & (
+                before[:, ndays:D] == before[:, :(D - ndays)]
+            )
+        big = np.any(spikes & (numbers >= 500), axis=1)
+
+        # for each spike, keep the first build of the day with enough installs
+        day_of_pos = np.repeat(np.arange(D), np.diff(np.append(starts, N)))
+        candidates = spikes[:, day_of_pos] & (counts != 0) & (installs >= threshold)
+        ranks = np.cumsum(candidates, axis=1)
+        ranks = np.concatenate([np.zeros_like(ranks[:, :1]), ranks], axis=1)
+        # ranks[:, pos + 1] - ranks[:, start] is the rank of pos in its day
+        first = candidates & (ranks[:, 1:] - ranks[:, starts[day_of_pos]] == 1)
+
+        res = {sgn: ({}, bool(b)) for sgn, b in zip(sgns, big)}
+        for i, pos in zip(*np.nonzero(first)):
+            res[sgns[i]][0][self.bids[pos]] = int(counts[i, pos])
+        return res
+
+
+def chunks(data, chunk_size):
+    """Yield successive chunks of size chunk_size from the list data"""
+    for i in range(0, len(data), chunk_size):
+        yield data[i:(i + chunk_size)]
+
+
+def pack(items, max_items, limits):
+    """Pack the items (in order) in chunks of at most max_items items.
+    limits is a list of (max weight, weight function): the total weight
+    of a chunk is at most max weight (an item too heavy is alone in its chunk)"""
+    chunk = []
+    totals = [0] * len(limits)
+    for item in items:
+        weights = [weight(item) for _, weight in limits]
+        full = len(chunk) == max_items or any(
+            t + w > m for t, w, (m, _) in zip(totals, weights, limits)
+        )
+        if chunk and full:
+            yield chunk
+            chunk = []
+            totals = [0] * len(limits)
+        chunk.append(item)
+        totals = [t + w for t, w in zip(totals, weights)]
+    if chunk:
+        yield chunk
+
+
 def get_sgns_by_bids(signatures):
     """Get signatures by buildid from the data"""
     sgn_by_bid = defaultdict(lambda: list())
@@ -5,6 +5,8 @@
 import os
 import redis
 from rq import Worker, Queue, suspension
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus
 from .logger import logger
 from . import config
 
@@ -13,6 +15,8 @@ listen = ["high", "default", "low"]
 redis_url = os.getenv("REDIS_URL", config.get_redis())
 conn = redis.from_url(redis_url, ssl_cert_reqs=None, ssl_check_hostname=False)
 __QUEUE = None
+# job id => number of enqueues coalesced with a pending job
+COALESCED_KEY = "clouseau:jobs:coalesced"
 
 
 def black_hole(job, *exc_info):
@@ -30,6 +34,56 @@ def get_queue(name="low"):
     return __QUEUE[name]
 
 
+def is_pending(job_id):
+    """Check if the job is queued or running"""
+    try:
+        job = Job.fetch(job_id, connection=conn)
+    except NoSuchJobError:
+        return False
+    return job.get_status() in (JobStatus.QUEUED, JobStatus.STARTED)
+
+
+def get_job_id(func, *args):
+    """Get a deterministic job id for func with the given arguments"""
+    return "-".join([func.__name__] + [str(a) for a in args])
+
+
+def enqueue_once(func, args=(), kwargs=None, job_id=None, queue="low"):
+    """Enqueue a job unless a job with the same id is already queued or running.
+    Return the job or None if it has been coalesced with the pending one."""
+    job_id = job_id or get_job_id(func, *args)
+    # single-flight: a concurrent caller holding the lock is enqueuing the same job
+    lock = "clouseau:jobs:lock:" + job_id
+    job = None
+    if conn.set(lock, 1, nx=True, ex=60):
+        try:
+            if not is_pending(job_id):
+                job = get_queue(queue).enqueue_call(
+                    func=func, args=args, kwargs=kwargs, job_id=job_id, result_ttl=0
+                )
+        finally:
+            conn.delete(lock)
+
+    if job is None:
+        conn.hincrby(COALESCED_KEY, job_id, 1)
+        logger.info("Job {} is already pending: coalesced.".format(job_id))
+    return job
+
+
+def get_stats():
+    """Get the number of queued and running jobs by queue and the coalesced jobs"""
+    stats = {"queues": {}, "coalesced": {}}
+    for name in listen:
+        queue = get_queue(name)
+        stats["queues"][name] = {
+            "queued": len(queue),
+            "started": queue.started_job_registry.count,
+        }
+    for job_id, n in conn.hgetall(COALESCED_KEY).items():
+        stats["coalesced"][job_id.decode("utf-8")] = int(n)
+    return stats
+
+
 def suspend():
     suspension.suspend(conn)
 
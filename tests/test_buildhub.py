@@ -2,10 +2,39 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import socket
+import threading
+import time
 import unittest
+from unittest import mock
 from crashclouseau import buildhub, utils
 
 
+class Handler(BaseHTTPRequestHandler):
+    """Answer 503 to the first request of each query then echo the query"""
+
+    protocol_version = "HTTP/1.1"
+    seen = set()
+
+    def do_POST(self):
+        query = self.rfile.read(int(self.headers["Content-Length"]))
+        if query in Handler.seen:
+            status, body = 200, query
+        else:
+            Handler.seen.add(query)
+            status, body = 503, b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
 class BuildhubTest(unittest.TestCase):
     def test_get(self):
         res = buildhub.get("20180201000000", "nightly", max_buildid="20180201110000")
@@ -77,3 +106,52 @@ class BuildhubTest(unittest.TestCase):
                 },
             ],
         )
+
+    @mock.patch("crashclouseau.config.get_buildhub_backoff_factor", return_value=1)
+    @mock.patch("crashclouseau.config.get_buildhub_max_backoff", return_value=5)
+    def test_get_delay(self, *args):
+        delays = [buildhub.get_delay(i, None) for i in range(5)]
+        self.assertEqual(delays, [1, 2, 4, 5, 5])
+        self.assertEqual(buildhub.get_delay(0, "3"), 3)
+        self.assertEqual(buildhub.get_delay(2, "3"), 4)
+        self.assertEqual(buildhub.get_delay(0, "foo"), 1)
+
+    @mock.patch("crashclouseau.httpclient.add_stats")
+    @mock.patch("crashclouseau.config.get_buildhub_backoff_factor", return_value=0.01)
+    def test_get_many(self, _, add_stats):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}".format(server.server_port)
+        try:
+            with mock.patch("crashclouseau.buildhub.URL", url):
+                queries = [({"query": i}, lambda x: x["query"]) for i in range(10)]
+                self.assertEqual(buildhub.get_many(queries), list(range(10)))
+
+                # each query has been retried once
+                host, requests, connections = add_stats.call_args[0]
+                self.assertEqual(host, url)
+                self.assertEqual(requests, 20)
+                self.assertLessEqual(connections, 4)
+
+                res = buildhub.make_request({"query": 10}, json.dumps)
+                self.assertEqual(res, '{"query": 10}')
+
+                # from a running event loop
+                async def get():
+                    return buildhub.make_request({"query": 11}, json.dumps)
+
+                self.assertEqual(asyncio.run(get()), '{"query": 11}')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    @mock.patch("crashclouseau.httpclient.add_stats")
+    def test_connection_error(self, *args):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            url = "http://127.0.0.1:{}".format(s.getsockname()[1])
+        with mock.patch("crashclouseau.buildhub.URL", url):
+            start = time.time()
+            self.assertIsNone(buildhub.make_request({"query": 0}, json.dumps))
+            # no retry when Buildhub cannot be reached
+            self.assertLess(time.time() - start, 1)
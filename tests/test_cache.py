@@ -0,0 +1,100 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import tempfile
+import unittest
+from crashclouseau import cache
+
+
+class CacheTest(unittest.TestCase):
+    def test_lru(self):
+        c = cache.LRU(2)
+        c.put("a", 1)
+        c.put("b", 2)
+        self.assertEqual(c.get("a"), 1)
+        c.put("c", 3)
+        self.assertEqual(len(c), 2)
+        self.assertIsNone(c.get("b"))
+        self.assertEqual(c.get_many(["a", "b", "c"]), {"a": 1, "c": 3})
+
+        c.put_many({"d": 4, "e": 5})
+        self.assertEqual(c.get_many(["a", "c", "d", "e"]), {"d": 4, "e": 5})
+
+        c.clear()
+        self.assertEqual(len(c), 0)
+
+    def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            value = {"dom/base/a.cpp": {"added": [1, 2], "deleted": [], "new": False}}
+            c = cache.DiskCache(tmp, 10000)
+            self.assertIsNone(c.get("abc"))
+            c.put("abc", value)
+            self.assertEqual(c.get("abc"), value)
+            self.assertIn("abc", c)
+
+            # another instance reads the same files
+            c = cache.DiskCache(tmp, 10000)
+            self.assertEqual(c.get("abc"), value)
+
+            c.clear()
+            self.assertIsNone(c.get("abc"))
+
+    def test_disk_cache_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            c = cache.DiskCache(tmp, 1000)
+            for i in range(3):
+                c.put(str(i), list(range(i, i + 50)))
+            size = c.size
+            # make "0" the most recently used value
+            os.utime(c._get_path("1"), (0, 0))
+            os.utime(c._get_path("2"), (1, 1))
+            c.max_size = size
+            c.put("3", [3])
+            self.assertEqual(c.get("0"), list(range(0, 50)))
+            self.assertIsNone(c.get("1"))
+            self.assertEqual(c.get("3"), [3])
+            self.assertLessEqual(c.size, c.max_size)
+
+    def test_disk_cache_replace(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            c = cache.DiskCache(tmp, 10000)
+            c.put("a", list(range(100)))
+            c.put("b", [1])
+            for _ in range(3):
+                c.put("a", list(range(50)))
+            self.assertEqual(c.size, sum(size for _, size, _ in c._get_files()))
+
+            c.delete("a")
+            self.assertIsNone(c.get("a"))
+            self.assertEqual(c.size, os.path.getsize(c._get_path("b")))
+            c.delete("a")
+            self.assertEqual(c.get("b"), [1])
+
+    def test_disk_cache_ttl(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            c = cache.DiskCache(tmp, 10000, ttl=60)
+            c.put("a", 1)
+            self.assertEqual(c.get("a"), 1)
+            c.ttl = -1
+            self.assertIsNone(c.get("a"))
+            self.assertFalse(os.path.exists(c._get_path("a")))
+
+    def test_ttl_cache(self):
+        c = cache.TTLCache(2)
+        c.put("a", "1", 60)
+        c.put("b", "2", -1)
+        self.assertEqual(c.get("a"), "1")
+        self.assertIsNone(c.get("b"))
+        c.put("c", "3", 60)
+        c.put("d", "4", 60)
+        self.assertIsNone(c.get("a"))
+        self.assertEqual(c.get("d"), "4")
+
+        c.incr("x:hits")
+        c.incr("x:hits")
+        self.assertEqual(c.get_stats(), {"x:hits": 2})
+        c.clear()
+        self.assertIsNone(c.get("d"))
+        self.assertEqual(c.get_stats(), {})
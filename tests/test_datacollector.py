@@ -0,0 +1,273 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import requests
+import unittest
+from unittest import mock
+from crashclouseau import cache, datacollector, utils
+
+
+BID = utils.get_build_date("20190101030000")
+
+
+class FakeSuperSearch(object):
+    """Answer the queries of get_proto_small: each signature has 3 proto-signatures"""
+
+    URL = "https://crash-stats.mozilla.org/api/SuperSearch/"
+    queries = []
+
+    def __init__(self, queries):
+        for query in queries:
+            FakeSuperSearch.queries.append(query.params["signature"])
+            protos = []
+            sgns = []
+            for sgn in query.params["signature"]:
+                sgn = sgn[1:]
+                installs = {"cardinality_install_time": {"value": 2}}
+                sgns.append({"term": sgn, "facets": installs})
+                for i in range(3):
+                    protos.append(
+                        {
+                            "term": "{}-proto{}".format(sgn, i),
+                            "count": 3 - i,
+                            "facets": {
+                                "uuid": [{"term": "{}-uuid{}".format(sgn, i)}],
+                                "signature": [{"term": sgn}],
+                            },
+                        }
+                    )
+            size = query.params["_facets_size"]
+            protos = sorted(protos, key=lambda p: -p["count"])[:size]
+            json = {"facets": {"proto_signature": protos, "signature": sgns[:size]}}
+            query.handler(json, query.handlerdata)
+
+    def wait(self):
+        pass
+
+
+# The responses of SuperSearch as formatted by Socorro: the facets of a nested
+# aggregation (_aggs.signature.proto_signature) are in the buckets of the first one
+PROTOS_BIG = {
+    "hits": [],
+    "total": 1800,
+    "errors": [],
+    "facets": {
+        "release_channel": [{"term": "nightly", "count": 1800}],
+        "signature": [
+            {
+                "term": "OOM | small",
+                "count": 1200,
+                "facets": {
+                    "proto_signature": [
+                        {
+                            "term": "OOM | small | mozalloc_abort | moz_xmalloc",
+                            "count": 1000,
+                            "facets": {"uuid": [{"term": "uuid-oom-0", "count": 1}]},
+                        },
+                        {
+                            "term": "OOM | small | mozalloc_abort | js::Alloc",
+                            "count": 200,
+                            "facets": {"uuid": [{"term": "uuid-oom-1", "count": 1}]},
+                        },
+                    ]
+                },
+            },
+            {
+                "term": "nsFoo::Bar",
+                "count": 600,
+                "facets": {
+                    "proto_signature": [
+                        {
+                            "term": "nsFoo::Bar | nsFoo::Run",
+                            "count": 600,
+                            "facets": {"uuid": [{"term": "uuid-foo-0", "count": 1}]},
+                        }
+                    ]
+                },
+            },
+        ],
+    },
+}
+
+INSTALLS_BIG = {
+    "hits": [],
+    "total": 1800,
+    "errors": [],
+    "facets": {
+        "release_channel": [{"term": "nightly", "count": 1800}],
+        "signature": [
+            {
+                "term": "OOM | small",
+                "count": 1200,
+                "facets": {"cardinality_install_time": {"value": 350}},
+            },
+            {
+                "term": "nsFoo::Bar",
+                "count": 600,
+                "facets": {"cardinality_install_time": {"value": 0}},
+            },
+        ],
+    },
+}
+
+
+class FakeSuperSearchBig(object):
+    """Answer the queries of get_proto_big with the responses above"""
+
+    URL = "https://crash-stats.mozilla.org/api/SuperSearch/"
+    queries = []
+
+    def __init__(self, queries):
+        for query in queries:
+            FakeSuperSearchBig.queries.append(query.params)
+            aggs = [name for name in query.params if name.startswith("_aggs.")]
+            if aggs == ["_aggs.signature.proto_signature"]:
+                json = PROTOS_BIG
+            elif aggs == ["_aggs.signature"]:
+                json = INSTALLS_BIG
+            else:
+                # Socorro has one aggregation by first-level field: the last one wins
+                raise Exception("Unexpected aggregations: {}".format(aggs))
+            query.handler(json, query.handlerdata)
+
+    def wait(self):
+        pass
+
+
+class DataCollectorTest(unittest.TestCase):
+    def setUp(self):
+        # the in-memory cache instead of the Redis one
+        patcher = mock.patch(
+            "crashclouseau.supersearch.get_cache", return_value=cache.TTLCache(100)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_signatures(self, n, count):
+        return {
+            "sgn{}".format(i): {
+                "bids": {BID: count},
+                "protos": {BID: []},
+                "installs": {BID: 0},
+            }
+            for i in range(n)
+        }
+
+    def test_plan_queries(self):
+        signatures = self.get_signatures(10, 3)
+        plan = datacollector.plan_queries(signatures, 4, {})
+        self.assertEqual([len(sgns) for _, sgns in plan], [4, 4, 2])
+
+        plan = datacollector.plan_queries(signatures, 10, {}, budget=7)
+        self.assertEqual([len(sgns) for _, sgns in plan], [2, 2, 2, 2, 2])
+        self.assertEqual(
+            sorted(s for _, sgns in plan for s in sgns), sorted(signatures.keys())
+        )
+
+    def test_plan_queries_url_length(self):
+        # the special characters are percent-encoded in the url
+        signatures = {
+            "mozilla::dom::Foo<{}> | std::vector<int>::operator[]".format(i): {
+                "bids": {BID: 1},
+                "protos": {BID: []},
+                "installs": {BID: 0},
+            }
+            for i in range(200)
+        }
+        base_params = {
+            "product": "Firefox",
+            "date": ">=2019-01-01",
+            "_aggs.proto_signature": ["uuid", "signature"],
+        }
+        plan = datacollector.plan_queries(signatures, 1000, base_params)
+        self.assertGreater(len(plan), 1)
+        for bid, sgns in plan:
+            params = dict(base_params, build_id=utils.get_buildid(bid))
+            params["signature"] = ["=" + s for s in sgns]
+            url = datacollector.socorro.SuperSearch.URL
+            req = requests.Request("GET", url, params=params).prepare()
+            self.assertEqual(len(req.url), datacollector.get_url_length(params))
+            self.assertLessEqual(len(req.url), datacollector.MAX_URL_LENGTH)
+        self.assertEqual(
+            sorted(s for _, sgns in plan for s in sgns), sorted(signatures.keys())
+        )
+
+    @mock.patch("crashclouseau.config.get_limit_facets", return_value=8)
+    @mock.patch("crashclouseau.config.get_threshold", return_value=3)
+    @mock.patch("libmozdata.socorro.SuperSearch", FakeSuperSearch)
+    def test_get_proto_small_truncated(self, *args):
+        FakeSuperSearch.queries = []
+        # the crash numbers are wrong: the first queries are truncated
+        signatures = self.get_signatures(8, 1)
+        datacollector.get_proto_small("Firefox", signatures, "", "nightly")
+
+        self.assertEqual(
+            [len(sgns) for sgns in FakeSuperSearch.queries], [8, 4, 4, 2, 2, 2, 2]
+        )
+        for sgn, info in signatures.items():
+            self.assertEqual(
+                [p["proto"] for p in info["protos"][BID]],
+                ["{}-proto{}".format(sgn, i) for i in range(3)],
+            )
+            self.assertEqual(info["installs"][BID], 2)
+
+    @mock.patch("crashclouseau.config.get_threshold", return_value=2)
+    @mock.patch("libmozdata.socorro.SuperSearch", FakeSuperSearchBig)
+    def test_get_proto_big(self, *args):
+        FakeSuperSearchBig.queries = []
+        signatures = {
+            sgn: {"bids": {BID: count}, "protos": {BID: []}, "installs": {BID: 0}}
+            for sgn, count in [("OOM | small", 1200), ("nsFoo::Bar", 600)]
+        }
+        datacollector.get_proto_big("Firefox", signatures, "", "nightly")
+
+        self.assertEqual(len(FakeSuperSearchBig.queries), 2)
+        self.assertEqual(
+            signatures["OOM | small"]["protos"][BID],
+            [
+                {
+                    "proto": "OOM | small | mozalloc_abort | moz_xmalloc",
+                    "count": 1000,
+                    "uuid": "uuid-oom-0",
+                },
+                {
+                    "proto": "OOM | small | mozalloc_abort | js::Alloc",
+                    "count": 200,
+                    "uuid": "uuid-oom-1",
+                },
+            ],
+        )
+        self.assertEqual(
+            signatures["nsFoo::Bar"]["protos"][BID],
+            [{"proto": "nsFoo::Bar | nsFoo::Run", "count": 600, "uuid": "uuid-foo-0"}],
+        )
+        self.assertEqual(signatures["OOM | small"]["installs"][BID], 350)
+        self.assertEqual(signatures["nsFoo::Bar"]["installs"][BID], 1)
+
+    @mock.patch("crashclouseau.config.get_limit_facets", return_value=1000)
+    @mock.patch("crashclouseau.config.get_threshold", return_value=1000)
+    @mock.patch("crashclouseau.supersearch.search")
+    def test_get_proto_big_url_length(self, search, *args):
+        signatures = {
+            "mozilla::dom::Foo<{}> | std::vector<int>::operator[]".format(i): {
+                "bids": {BID: 1000},
+                "protos": {BID: []},
+                "installs": {BID: 0},
+            }
+            for i in range(200)
+        }
+        datacollector.get_proto_big("Firefox", signatures, ">=2019-01-01", "nightly")
+
+        # the protos queries and then the installs ones
+        self.assertEqual(search.call_count, 2)
+        for call in search.call_args_list:
+            queries = call.kwargs["queries"]
+            self.assertGreater(len(queries), 1)
+            for query in queries:
+                length = datacollector.get_url_length(query.params)
+                self.assertLessEqual(length, datacollector.MAX_URL_LENGTH)
+            self.assertEqual(
+                sorted(s[1:] for q in queries for s in q.params["signature"]),
+                sorted(signatures.keys()),
+            )
@@ -0,0 +1,167 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import requests
+import tempfile
+import unittest
+from unittest import mock
+from crashclouseau import cache, patch
+from crashclouseau.hgbackend import HTTPBackend, LocalBackend
+
+
+PATCH = """# HG changeset patch
+# User Foo Bar <foo@bar.com>
+# Node ID b9a1d6c6bb7b1d0d2b3bd7c3b7f1d3cbd4e6f7a8
+Bug 123 - Fix a crash
+
+diff --git a/dom/base/nsFoo.cpp b/dom/base/nsFoo.cpp
+--- a/dom/base/nsFoo.cpp
++++ b/dom/base/nsFoo.cpp
+@@ -1,3 +1,4 @@
+ int a = 1;
+-int b = 2;
++int b = 3;
++int c = 4;
+ int d = 5;
+diff --git a/dom/base/moz.build b/dom/base/moz.build
+--- a/dom/base/moz.build
++++ b/dom/base/moz.build
+@@ -1,1 +1,2 @@
+ FOO = 1
++BAR = 2
+"""
+
+
+class FakeBackend(LocalBackend):
+    def __init__(self, outputs):
+        super(FakeBackend, self).__init__({"nightly": "/path/to/mozilla-central"})
+        self.outputs = outputs
+        self.calls = []
+
+    def run(self, channel, cmd, **kwargs):
+        self.calls.append((channel, cmd, kwargs))
+        out = self.outputs[cmd]
+        return out[kwargs["r"]] if isinstance(out, dict) else out
+
+
+class HGBackendTest(unittest.TestCase):
+    def test_get_pushes(self):
+        nullid = "0" * 40
+        rows = [
+            ["12", "1500000000 0", "a" * 40, "Foo <foo@bar.com>", "Bug 1 - A"],
+            ["12", "1500000000 0", "c" * 40, "Foo <foo@bar.com>", "Bug 2 - B"],
+            ["13", "1500000100 0", "d" * 40, "Bar <bar@foo.com>", "Merge"],
+        ]
+        parents_files = [
+            ["b" * 40, nullid, "dom/a.cpp\ndom/b.h"],
+            ["a" * 40, nullid, ""],
+            ["c" * 40, "e" * 40, "dom/c.cpp"],
+        ]
+        rows = [r + pf for r, pf in zip(rows, parents_files)]
+        out = "".join(x + "\0" for row in rows for x in row)
+        revset = "pushid(12) or pushid(13)"
+        backend = FakeBackend(
+            {b"log": {"abc": b"11", "def": b"13", revset: out.encode("utf-8")}}
+        )
+
+        data = backend.get_pushes_by_revs("abc", "def", "nightly")
+        # the pushes are selected by push id as json-pushes does
+        self.assertEqual(backend.calls[-1][2]["r"], revset)
+        self.assertEqual(
+            data,
+            {
+                "pushes": {
+                    "12": {
+                        "date": 1500000000,
+                        "changesets": [
+                            {
+                                "node": "a" * 40,
+                                "author": "Foo <foo@bar.com>",
+                                "desc": "Bug 1 - A",
+                                "parents": ["b" * 40],
+                                "files": ["dom/a.cpp", "dom/b.h"],
+                            },
+                            {
+                                "node": "c" * 40,
+                                "author": "Foo <foo@bar.com>",
+                                "desc": "Bug 2 - B",
+                                "parents": ["a" * 40],
+                                "files": [],
+                            },
+                        ],
+                    },
+                    "13": {
+                        "date": 1500000100,
+                        "changesets": [
+                            {
+                                "node": "d" * 40,
+                                "author": "Bar <bar@foo.com>",
+                                "desc": "Merge",
+                                "parents": ["c" * 40, "e" * 40],
+                                "files": ["dom/c.cpp"],
+                            }
+                        ],
+                    },
+                }
+            },
+        )
+
+    def test_get_pushes_by_revs_empty(self):
+        backend = FakeBackend({b"log": {"abc": b"13", "def": b"13", "xyz": b""}})
+        self.assertEqual(
+            backend.get_pushes_by_revs("abc", "def", "nightly"), {"pushes": {}}
+        )
+        self.assertEqual(
+            backend.get_pushes_by_revs("abc", "xyz", "nightly"), {"pushes": {}}
+        )
+        self.assertEqual(len(backend.calls), 4)
+
+    def test_refresh(self):
+        backend = FakeBackend({b"pull": b""})
+        backend.refresh("nightly")
+        self.assertEqual(backend.calls, [("nightly", b"pull", {})])
+        backend.pull = False
+        backend.refresh("nightly")
+        self.assertEqual(len(backend.calls), 1)
+
+    @mock.patch("crashclouseau.httpclient.get")
+    def test_get_last_pushdate(self, get):
+        get.return_value.json.return_value = {
+            "lastpushid": 13,
+            "pushes": {"13": {"date": 1500000100, "changesets": ["d" * 40]}},
+        }
+        date = HTTPBackend().get_last_pushdate("nightly")
+        self.assertEqual(date.timestamp(), 1500000100)
+        # only the tips without their files
+        self.assertEqual(get.call_args[1]["params"], {"tipsonly": 1, "version": 2})
+
+    def test_parse_patch(self):
+        backend = FakeBackend({b"export": PATCH.encode("utf-8")})
+        res = backend.parse_patch("b9a1d6c6bb7b", "nightly")
+        self.assertEqual(
+            res,
+            {
+                "dom/base/nsFoo.cpp": {
+                    "added": [3],
+                    "deleted": [],
+                    "touched": [2],
+                    "new": False,
+                }
+            },
+        )
+
+    @mock.patch("crashclouseau.httpclient.get")
+    def test_parse_patch_error(self, get):
+        r = requests.Response()
+        r.status_code = 404
+        r._content = b"<html>revision not found</html>"
+        get.return_value = r
+        with tempfile.TemporaryDirectory() as path:
+            c = cache.DiskCache(path, 1024 * 1024)
+            with mock.patch(
+                "crashclouseau.hgbackend.get_backend", return_value=HTTPBackend()
+            ), mock.patch("crashclouseau.patch.get_cache", return_value=c):
+                with self.assertRaises(requests.HTTPError):
+                    patch.parse("b9a1d6c6bb7b")
+            self.assertNotIn("b9a1d6c6bb7b", c)
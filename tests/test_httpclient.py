@@ -0,0 +1,69 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import defaultdict
+import threading
+import unittest
+from unittest import mock
+from crashclouseau import httpclient
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"path": "' + self.path.encode("utf-8") + b'"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeRedis(object):
+    """The hash commands used for the stats"""
+
+    def __init__(self):
+        self.hashes = defaultdict(dict)
+
+    def hincrby(self, name, key, n):
+        h = self.hashes[name]
+        key = key.encode("utf-8")
+        h[key] = h.get(key, 0) + n
+
+    def hgetall(self, name):
+        return {k: str(v).encode("utf-8") for k, v in self.hashes[name].items()}
+
+
+class HTTPClientTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("crashclouseau.worker.conn", FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}".format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        for i in range(5):
+            r = httpclient.get("{}/{}".format(self.url, i))
+            self.assertEqual(r.json(), {"path": "/{}".format(i)})
+
+        self.assertIs(httpclient.get_session(), httpclient.get_session())
+        # the stats are in Redis to be shared by the workers and the web app
+        stats = httpclient.get_stats()[self.url]
+        self.assertEqual(stats, {"requests": 5, "connections": 1, "reused": 4})
+
+    def test_retries(self):
+        retries = httpclient.get_session().get_adapter(self.url).max_retries
+        self.assertTrue(retries.is_retry("GET", 503))
+        self.assertFalse(retries.is_retry("POST", 503))
@@ -0,0 +1,61 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import unittest
+from crashclouseau import inspector
+
+
+def make_frame(n, node="0123456789ab"):
+    return {
+        "file": "hg:hg.mozilla.org/mozilla-central:dom/base/f{}.cpp:{}".format(n, node),
+        "function": "f{}".format(n),
+        "line": n + 1,
+        "module": "xul.dll",
+        "offset": "0x{:x}".format(n),
+        "registers": {"rax": "0x0"},
+        "trust": "cfi",
+    }
+
+
+class InspectorTest(unittest.TestCase):
+    def test_compact_crash(self):
+        data = {
+            "build": "20190101000000",
+            "release_channel": "nightly",
+            "product": "Firefox",
+            "uuid": "a2fc5a18-7d2a-4a2f-9d5e-1e1e3c190101",
+            "json_dump": {
+                "crash_info": {"crashing_thread": 1, "type": "EXCEPTION"},
+                "modules": [{"filename": "xul.dll"}] * 100,
+                "threads": [
+                    {"frames": [make_frame(n) for n in range(10)]},
+                    {"frames": [make_frame(n) for n in range(80)]},
+                    {"frames": [make_frame(n) for n in range(10)]},
+                ],
+            },
+        }
+        compact = inspector.compact_crash(data)
+
+        self.assertEqual(
+            set(compact.keys()), {"build", "release_channel", "product", "json_dump"}
+        )
+        self.assertEqual(len(compact["json_dump"]["threads"]), 1)
+        self.assertLess(len(json.dumps(compact)), len(json.dumps(data)) / 2)
+        self.assertEqual(
+            inspector.inspect_stacktrace(compact, "0123456789ab"),
+            inspector.inspect_stacktrace(data, "0123456789ab"),
+        )
+        frames, _ = inspector.inspect_stacktrace(compact, "0123456789ab")
+        self.assertEqual(len(frames), inspector.MAX_FRAMES)
+
+    def test_compact_crash_without_thread(self):
+        data = {"json_dump": {"crash_info": {}, "threads": [{"frames": []}]}}
+        compact = inspector.compact_crash(data)
+        self.assertEqual(
+            inspector.inspect_stacktrace(compact, "0123456789ab"), ([], set())
+        )
+
+        data = {"java_stack_trace": "java.lang.NullPointerException"}
+        self.assertEqual(inspector.compact_crash(data), data)
@@ -0,0 +1,148 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from collections import namedtuple
+from datetime import datetime
+import pytz
+import random
+import unittest
+from unittest import mock
+from crashclouseau import models
+
+
+Row = namedtuple("Row", ["id", "signature"])
+
+
+class FakeRedis(object):
+    """The hash commands used by RedisLRU"""
+
+    def __init__(self):
+        self.hashes = {}
+
+    def hmget(self, name, keys):
+        h = self.hashes.get(name, {})
+        return [h.get(k) for k in keys]
+
+    def hset(self, name, mapping):
+        self.hashes.setdefault(name, {}).update(
+            {k: str(v).encode("utf-8") for k, v in mapping.items()}
+        )
+
+    def hlen(self, name):
+        return len(self.hashes.get(name, {}))
+
+    def hrandfield(self, name, count):
+        return random.sample(list(self.hashes.get(name, {})), count)
+
+    def hdel(self, name, *keys):
+        h = self.hashes.get(name, {})
+        for k in keys:
+            h.pop(k, None)
+
+    def delete(self, name):
+        self.hashes.pop(name, None)
+
+
+class ModelsTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeRedis()
+        self.executed = []
+        setattr(models, "__SIGNATURE_IDS", None)
+
+    def tearDown(self):
+        setattr(models, "__SIGNATURE_IDS", None)
+
+    def execute(self, query):
+        # the signatures table: sgn<N> has the id N
+        signatures = query.compile().params["param_1"]
+        self.executed.append(sorted(signatures))
+        return [Row(int(s[3:]), s) for s in signatures]
+
+    def test_signature_ids_cache(self):
+        with mock.patch("crashclouseau.worker.conn", self.conn), mock.patch.object(
+            models.db.session, "execute", side_effect=self.execute
+        ), mock.patch.object(models.db.session, "commit"):
+            ids = models.Signature.get_ids(["sgn1", "sgn2"])
+            self.assertEqual(ids, {"sgn1": 1, "sgn2": 2})
+            ids_cache = models.get_signature_ids_cache()
+            self.assertIsInstance(ids_cache, models.cache.RedisLRU)
+
+            # a new job runs in a new fork: its process-local LRU is empty
+            setattr(models, "__SIGNATURE_IDS", None)
+            ids = models.Signature.get_ids(["sgn1", "sgn2", "sgn3"])
+            self.assertEqual(ids, {"sgn1": 1, "sgn2": 2, "sgn3": 3})
+
+        # only the unknown signature has been queried in the second job
+        self.assertEqual(self.executed, [["sgn1", "sgn2"], ["sgn3"]])
+
+    def test_signature_ids_cache_bound(self):
+        ids_cache = models.cache.RedisLRU(3, self.conn, "ids", loads=int)
+        ids_cache.put_many({"sgn1": 1, "sgn2": 2})
+        ids_cache.put_many({"sgn3": 3, "sgn4": 4, "sgn5": 5})
+        # the Redis hash is bounded like the process-local LRU
+        self.assertEqual(self.conn.hlen("ids"), 3)
+        for key, value in self.conn.hashes["ids"].items():
+            self.assertEqual(int(value), int(key[3:]))
+
+
+def has_database():
+    try:
+        models.db.session.execute(models.db.text("SELECT 1"))
+        return True
+    except Exception:
+        models.db.session.rollback()
+        return False
+
+
+@unittest.skipUnless(has_database(), "requires the database")
+class UUIDTest(unittest.TestCase):
+    def setUp(self):
+        models.create()
+        self.sgn = models.Signature("clouseau::test::reset")
+        date = datetime(2019, 1, 1, tzinfo=pytz.utc)
+        info = {
+            "node": "c10u5eau7e57",
+            "date": date,
+            "backedout": False,
+            "merge": False,
+            "bug": 1,
+        }
+        self.node = models.Node("nightly", info, None)
+        models.db.session.add_all([self.sgn, self.node])
+        models.db.session.flush()
+        self.build = models.Build(date, "Firefox", "nightly", "66.0a1", self.node.id)
+        models.db.session.add(self.build)
+        models.db.session.commit()
+
+    def tearDown(self):
+        models.db.session.rollback()
+        # the build, the reports and the summaries are removed in cascade
+        models.db.session.delete(self.node)
+        models.db.session.delete(self.sgn)
+        models.db.session.commit()
+
+    def test_reset(self):
+        now = datetime.now(pytz.utc)
+        uuids = ["clouseau-test-reset-error", "clouseau-test-reset-claimed"]
+        for uuid in uuids:
+            models.db.session.add(
+                models.UUID(uuid, self.sgn.id, "protohash", self.build.id)
+            )
+        models.db.session.flush()
+        models.db.session.execute(
+            models.db.update(models.UUID)
+            .where(models.UUID.uuid == uuids[0])
+            .values(analyzed=True, error=True)
+        )
+        models.db.session.execute(
+            models.db.update(models.UUID)
+            .where(models.UUID.uuid == uuids[1])
+            .values(analyzed=True, claimed=now)
+        )
+        models.db.session.commit()
+
+        models.UUID.reset(uuids)
+
+        claimed = {r.uuid for r in models.UUID.claim(1000, 1800)}
+        self.assertTrue(set(uuids) <= claimed)
@@ -0,0 +1,54 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+from unittest import mock
+from crashclouseau import cache, supersearch
+
+
+class FakeSuperSearch(object):
+    URL = "https://crash-stats.mozilla.org/api/SuperSearch/"
+    calls = 0
+
+    def __init__(self, queries):
+        for query in queries:
+            FakeSuperSearch.calls += 1
+            data = {"errors": [], "facets": {"product": query.params["product"]}}
+            query.handler(data, query.handlerdata)
+
+    def wait(self):
+        return self
+
+
+class SuperSearchTest(unittest.TestCase):
+    def setUp(self):
+        # the in-memory cache instead of the Redis one
+        patcher = mock.patch(
+            "crashclouseau.supersearch.get_cache", return_value=cache.TTLCache(100)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        FakeSuperSearch.calls = 0
+
+    def test_get_key(self):
+        key = supersearch.get_key
+        self.assertEqual(
+            key("url", {"a": ["x", "y"], "b": 1, "c": None}),
+            key("url", {"b": "1", "a": ["y", "x"]}),
+        )
+        self.assertEqual(key("url", {"a": ["x"]}), key("url", {"a": "x"}))
+        self.assertNotEqual(key("url", {"a": "x"}), key("url", {"a": "y"}))
+        self.assertNotEqual(
+            key("url", {"_sort": ["a", "-b"]}), key("url", {"_sort": ["-b", "a"]})
+        )
+
+    @mock.patch("libmozdata.socorro.SuperSearch", FakeSuperSearch)
+    def test_search(self):
+        for _ in range(2):
+            for product in ["Firefox", "Fennec"]:
+                data = supersearch.get({"product": product}, kind="test")
+                self.assertEqual(data["facets"]["product"], product)
+
+        self.assertEqual(FakeSuperSearch.calls, 2)
+        self.assertEqual(supersearch.get_stats(), {"test": {"hits": 2, "misses": 2}})
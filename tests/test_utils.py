@@ -0,0 +1,100 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from datetime import datetime
+import random
+import unittest
+from crashclouseau import utils
+
+
+def make_numbers(nsgns, ndays=8, seed=42):
+    """Make the crash numbers for nsgns signatures on ndays with 2 builds a day"""
+    rnd = random.Random(seed)
+    bids = []
+    for day in range(1, ndays + 1):
+        bids.append("201901{:02d}030000".format(day))
+        bids.append("201901{:02d}150000".format(day))
+
+    data = {}
+    for n in range(nsgns):
+        # crash in a random subset of the builds, more likely in the last ones
+        first = rnd.randrange(len(bids))
+        for bid in bids[first:]:
+            if rnd.random() < 0.5:
+                count = rnd.choice([1, 5, 50, 600])
+                installs = rnd.randint(1, 10)
+                data.setdefault("sgn{}".format(n), []).append((bid, count, installs))
+    return bids, data
+
+
+def make_dict_numbers(bids, crashes):
+    """Make the numbers for a signature as expected by get_new_crashing_bids"""
+    numbers = {}
+    for bid in bids:
+        bid = utils.get_build_date(bid)
+        day = datetime(bid.year, bid.month, bid.day)
+        if day not in numbers:
+            numbers[day] = {"installs": {}, "bids": {}, "count": 0}
+        numbers[day]["bids"][bid] = 0
+    for bid, count, installs in crashes:
+        bid = utils.get_build_date(bid)
+        day = datetime(bid.year, bid.month, bid.day)
+        numbers[day]["count"] += count
+        numbers[day]["bids"][bid] = count
+        numbers[day]["installs"][bid] = installs
+    return numbers
+
+
+class UtilsTest(unittest.TestCase):
+    def test_crash_numbers(self):
+        bids, data = make_numbers(500)
+        numbers = utils.CrashNumbers(bids)
+        for sgn, crashes in data.items():
+            for bid, count, installs in crashes:
+                numbers.add(sgn, bid, count, installs)
+
+        self.assertEqual(len(numbers), len(data))
+        self.assertEqual(set(numbers), set(data))
+        self.assertEqual(len(numbers.bids), 16)
+        self.assertEqual(len(numbers.days), 8)
+        # a build is found whatever the type used by Socorro for it
+        self.assertEqual(numbers.get_position("20190101150000"), 1)
+        self.assertEqual(numbers.get_position(20190102030000), 2)
+
+    def test_new_crashing_bids(self):
+        bids, data = make_numbers(2000)
+        numbers = utils.CrashNumbers(bids)
+        for sgn, crashes in data.items():
+            for bid, count, installs in crashes:
+                numbers.add(sgn, bid, count, installs)
+        expected = {sgn: make_dict_numbers(bids, c) for sgn, c in data.items()}
+
+        for ndays in [0, 1, 3, 8, 10]:
+            for threshold in [1, 5]:
+                res = numbers.get_new_crashing_bids(ndays, threshold)
+                self.assertEqual(set(res), set(data))
+                for sgn, numbers_sgn in expected.items():
+                    self.assertEqual(
+                        res[sgn],
+                        utils.get_new_crashing_bids(numbers_sgn, ndays, threshold),
+                    )
+
+        self.assertEqual(utils.CrashNumbers(bids).get_new_crashing_bids(3, 1), {})
+
+    def test_pack(self):
+        items = ["a" * n for n in [1, 2, 3, 10, 1, 1, 1, 1]]
+        self.assertEqual(
+            list(utils.pack(items, 3, [(6, len)])),
+            [["a", "aa", "aaa"], ["a" * 10], ["a", "a", "a"], ["a"]],
+        )
+        self.assertEqual(list(utils.pack(items, 10, [(100, len)])), [items])
+        self.assertEqual(list(utils.pack([], 10, [(100, len)])), [])
+
+        # the number of "a" and the total length
+        items = ["a", "aaa", "bbbbbbbb", "ab", "abab"]
+        limits = [(4, lambda x: x.count("a")), (9, len)]
+        self.assertEqual(
+            list(utils.pack(items, 10, limits)),
+            [["a", "aaa"], ["bbbbbbbb"], ["ab", "abab"]],
+        )